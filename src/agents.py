@@ -1,31 +1,22 @@
 # src/agents.py
 from langchain_openai import ChatOpenAI
 from langgraph.prebuilt import create_react_agent
-from .tools import calculator # Assuming tools.py is in the same directory
+from .tools import batch_calculator, calculator # Assuming tools.py is in the same directory
 # The financial_context_lookup tool will be created dynamically in main.py or workflow.py
 # and passed to the agent creation function.
 
-def create_math_agent(llm: ChatOpenAI):
-    return create_react_agent(
-        model=llm,
-        tools=[calculator],
-        name="math_expert",
-        prompt=(
-            "You are a math expert. ALWAYS use the calculator tool for ALL calculations.\n\n"
-            "If you see extracted financial data like '2008 = $181,001' and '2009 = $206,588':\n"
-            "1. Remove $ and commas: 181001 and 206588\n"
-            "2. Use calculator for: ((206588 - 181001) / 181001) * 100\n"
-            "3. Report the percentage result\n\n"
-            "NEVER calculate in your head. ALWAYS use the calculator tool."
-        )
-    )
+# Static system prompts, kept byte-identical across calls so backends can reuse their prompt-prefix cache
+_MATH_EXPERT_PROMPT = (
+    "You are a math expert. ALWAYS use the calculator tool for ALL calculations.\n\n"
+    "If you see extracted financial data like '2008 = $181,001' and '2009 = $206,588':\n"
+    "1. Remove $ and commas: 181001 and 206588\n"
+    "2. Use calculator for: ((206588 - 181001) / 181001) * 100\n"
+    "3. Start your reply with the result on its own line, e.g. 'Final answer: 14.1%', then explain briefly\n\n"
+    "When several calculations are needed, send them together in ONE batch_calculator call.\n\n"
+    "NEVER calculate in your head. ALWAYS use the calculator tool."
+)
 
-def create_financial_research_agent(llm: ChatOpenAI, financial_lookup_tool):
-    return create_react_agent(
-        model=llm,
-        tools=[financial_lookup_tool],
-        name="financial_research_expert",
-        prompt="""
+_FINANCIAL_RESEARCH_PROMPT = """
 You are a financial data extraction expert. Your ONLY job is to extract data and request calculation from the math expert.
 
 **MANDATORY PROCESS:**
@@ -58,4 +49,19 @@ STOP HERE. Do not calculate. Do not answer the question.
 **VERIFICATION:**
 State: "I extracted these exact values: 2008 = [value], 2009 = [value]"
 """
+
+def create_math_agent(llm: ChatOpenAI):
+    return create_react_agent(
+        model=llm,
+        tools=[calculator, batch_calculator],
+        name="math_expert",
+        prompt=_MATH_EXPERT_PROMPT,
+    )
+
+def create_financial_research_agent(llm: ChatOpenAI, financial_lookup_tool):
+    return create_react_agent(
+        model=llm,
+        tools=[financial_lookup_tool],
+        name="financial_research_expert",
+        prompt=_FINANCIAL_RESEARCH_PROMPT,
     )
@@ -1,5 +1,10 @@
 # src/config.py
+import functools
 import os
+import re
+import sys
+import time
+from types import MappingProxyType
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,43 +20,158 @@ OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', "http://localhost:1234/v1")
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', "lm-studio")
 MODEL_TEMPERATURE = float(os.getenv('MODEL_TEMPERATURE', 0.1))
 MODEL_STREAMING = os.getenv('MODEL_STREAMING', "True").lower() == "true"
+# How long local servers keep the model (and its prompt-prefix KV cache) loaded between requests
+MODEL_KEEP_ALIVE_SECONDS = int(os.getenv('MODEL_KEEP_ALIVE_SECONDS', 3600))
+
+# Logging Configuration (DEBUG shows the retrieval details printed by the lookup tool)
+LOG_LEVEL = os.getenv('LOG_LEVEL', "INFO").upper()
 
 # Data Configuration
 DATASET_PATH = os.getenv('DATASET_PATH', "./data/train.json") # Relative to project root
 
-# Ensure LangSmith vars are set if tracing is enabled
-if LANGCHAIN_TRACING_V2 == "true":
-    os.environ["LANGCHAIN_TRACING_V2"] = LANGCHAIN_TRACING_V2
+# Retrieval Configuration
+# Sentence-transformers model used to embed dataset questions (e.g. "all-MiniLM-L6-v2");
+# empty by default because sentence-transformers is optional, which means lexical matching only
+EMBEDDING_MODEL_NAME = os.getenv('EMBEDDING_MODEL_NAME', "")
+RAG_CACHE_DIR = os.getenv('RAG_CACHE_DIR', "./.cache") # Precomputed embeddings are stored here
+# Candidates visited per HNSW query when FAISS is installed (higher = better recall, slower)
+RAG_HNSW_EF_SEARCH = int(os.getenv('RAG_HNSW_EF_SEARCH', 64))
+
+# Response Cache Configuration
+# Chat answers are replayed for questions at least this similar to one already answered
+RESPONSE_CACHE_THRESHOLD = float(os.getenv('RESPONSE_CACHE_THRESHOLD', 0.92))
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', os.path.join(RAG_CACHE_DIR, "response_cache.json"))
+
+# Ensure LangSmith vars are set if tracing is enabled (runs once, before the first LLM is built)
+@functools.lru_cache(maxsize=1)
+def init_tracing_env() -> None:
+    if LANGCHAIN_TRACING_V2 != "true":
+        return
+    tracing_env = {"LANGCHAIN_TRACING_V2": LANGCHAIN_TRACING_V2}
     if LANGCHAIN_API_KEY:
-        os.environ["LANGCHAIN_API_KEY"] = LANGCHAIN_API_KEY
+        tracing_env["LANGCHAIN_API_KEY"] = LANGCHAIN_API_KEY
     else:
         print("Warning: LANGSMITH_API_KEY not set, but tracing is enabled.")
     if LANGCHAIN_PROJECT:
-        os.environ["LANGCHAIN_PROJECT"] = LANGCHAIN_PROJECT
+        tracing_env["LANGCHAIN_PROJECT"] = LANGCHAIN_PROJECT
     else:
         print("Warning: LANGSMITH_PROJECT not set, but tracing is enabled.")
+    os.environ.update(tracing_env)
 
 # --- Helper to get LLM settings ---
-def get_llm_config() -> dict:
-    return {
+def _keep_alive_body(base_url: str) -> dict:
+    """Request fields that stop local servers from unloading the model between turns.
+
+    The system prompts are static, so a model that stays loaded can reuse the cached
+    prompt prefix instead of re-running prefill. Hosted APIs reject unknown fields,
+    so this only applies to servers recognised from the base URL.
+    """
+    url = base_url.lower()
+    if ':11434' in url or 'ollama' in url:
+        return {'keep_alive': MODEL_KEEP_ALIVE_SECONDS}
+    if ':1234' in url or 'lmstudio' in url:
+        return {'ttl': MODEL_KEEP_ALIVE_SECONDS}
+    return {}
+
+@functools.lru_cache(maxsize=1)
+def get_llm_config() -> MappingProxyType:
+    """Read-only LLM settings, built once and shared by every agent"""
+    init_tracing_env()
+    config = {
         'model': OPENAI_MODEL_NAME,
         'base_url': OPENAI_BASE_URL,
         'api_key': OPENAI_API_KEY,
         'temperature': MODEL_TEMPERATURE,
         'streaming': MODEL_STREAMING,
     }
+    extra_body = _keep_alive_body(OPENAI_BASE_URL)
+    if extra_body and MODEL_KEEP_ALIVE_SECONDS > 0:
+        config['extra_body'] = extra_body
+    return MappingProxyType(config)
+
+# Patterns stripped from model responses, compiled once at import
+_THINK_RE = re.compile(r'<think>.*?</think>', re.DOTALL)
+_XFER_RE = re.compile(r'Transferring back to supervisor.*?supervisor', re.DOTALL)
+
+def _clean_response(response: str) -> str:
+    """Whitespace and supervisor-message cleanup shared by both filters"""
+    # Remove leading/trailing whitespace
+    response = response.strip()
+    
+    # Remove "Transferring back to supervisor" messages
+    response = _XFER_RE.sub('', response)
+    
+    return response
 
 def filter_response(response: str) -> str:
     """Remove thinking tokens and clean up model responses"""
-    import re
-    
     # Remove <think> blocks
-    response = re.sub(r'<think>.*?</think>', '', response, flags=re.DOTALL)
+    return _clean_response(_THINK_RE.sub('', response))
+
+class ThinkFilter:
+    """Streaming equivalent of filter_response: strips <think> blocks chunk by chunk"""
+    _OPEN, _CLOSE = '<think>', '</think>'
     
-    # Remove leading/trailing whitespace
-    response = response.strip()
+    def __init__(self):
+        self.in_think = False
+        self._pending = ""  # Chunk tail that may be the start of a split tag
+        self._held = []     # Text of the open <think> block, kept in case it never closes
+        self._parts = []    # Visible text so far
     
-    # Remove "Transferring back to supervisor" messages
-    response = re.sub(r'Transferring back to supervisor.*?supervisor', '', response, flags=re.DOTALL)
+    def feed(self, chunk: str) -> str:
+        """Consume one chunk and return the newly visible text"""
+        text = self._pending + chunk
+        out = []
+        pos = 0
+        while True:
+            tag = self._CLOSE if self.in_think else self._OPEN
+            i = text.find(tag, pos)
+            if i < 0:
+                break
+            if self.in_think:
+                self._held = []  # Block closed, drop its contents
+            else:
+                out.append(text[pos:i])
+                self._held = [self._OPEN]
+            self.in_think = not self.in_think
+            pos = i + len(tag)
+        
+        # Hold back a suffix that could still grow into the next tag
+        rest = text[pos:]
+        keep = next((n for n in range(min(len(tag) - 1, len(rest)), 0, -1) if tag.startswith(rest[-n:])), 0)
+        self._pending = rest[len(rest) - keep:]
+        (self._held if self.in_think else out).append(rest[:len(rest) - keep])
+        
+        visible = ''.join(out)
+        self._parts.append(visible)
+        return visible
     
-    return response
\ No newline at end of file
+    def result(self) -> str:
+        """Filtered response so far, cleaned the same way as filter_response"""
+        # An unclosed block is kept verbatim, as the regex in filter_response would leave it
+        tail = ''.join(self._held) if self.in_think else ''
+        return _clean_response(''.join(self._parts) + tail + self._pending)
+
+class StreamBuffer:
+    """Coalesces streamed tokens into fewer stdout writes instead of one flush per token"""
+
+    def __init__(self, min_chars: int = 32, max_delay: float = 0.05):
+        self.min_chars = min_chars
+        self.max_delay = max_delay
+        self._pending = []
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, text: str) -> None:
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if self._pending_chars >= self.min_chars or time.monotonic() - self._last_flush > self.max_delay:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._pending:
+            sys.stdout.write("".join(self._pending))
+            sys.stdout.flush()
+            self._pending.clear()
+            self._pending_chars = 0
+        self._last_flush = time.monotonic()
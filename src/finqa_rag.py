@@ -1,41 +1,106 @@
 # src/rag_system.py
+import functools
+import hashlib
+import heapq
 import json
-from typing import List, Dict, Any
-from difflib import SequenceMatcher
+import mmap
+from operator import itemgetter
+from typing import List, Dict, Any, Optional, Tuple
 import os # For path joining if needed
 
+import numpy as np
+import orjson
+from rapidfuzz import fuzz
+
+from .config import EMBEDDING_MODEL_NAME, RAG_CACHE_DIR, RAG_HNSW_EF_SEARCH
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError: # Optional dependency, lexical matching is used without it
+    SentenceTransformer = None
+
+try:
+    import faiss
+except ImportError: # Optional dependency, the NumPy int8 scan is used without it
+    faiss = None
+
+# HNSW graph settings; below _HNSW_MIN_ITEMS questions an exact flat index is used instead
+_HNSW_MIN_ITEMS = 1000
+_HNSW_NEIGHBORS = 32
+_HNSW_EF_CONSTRUCTION = 200
+
 # You might import DATASET_PATH from config if it becomes complex
 # from .config import DATASET_PATH # Assuming config.py is in the same directory or PYTHONPATH is set
 
+def format_table(table_data: List[List[Any]]) -> str:
+    """Render table rows as '  • label: value | value' lines for clearer data extraction"""
+    if not table_data:
+        return "No table data available."
+    lines = []
+    for i, row in enumerate(table_data):
+        # Format each row clearly
+        if len(row) > 1:
+            row_label = str(row[0]) if row[0] else f"Row {i+1}"
+            row_values = [str(cell) for cell in row[1:] if cell]
+            if row_values:
+                lines.append(f"  • {row_label}: {' | '.join(row_values)}\n")
+        else:
+            lines.append(f"  • {' | '.join(str(cell) for cell in row if cell)}\n")
+    return "\n" + "".join(lines)
+
 class FinancialRAGSystem:
-    def __init__(self, dataset_path: str): # Pass dataset_path
+    def __init__(self, dataset_path: str, embedding_model: Optional[str] = EMBEDDING_MODEL_NAME): # Pass dataset_path
         self.dataset_path = dataset_path
         self.dataset = self._load_dataset() # Make load_dataset private convention
+        for item in self.dataset:
+            self._prepare_item(item)
+        self._context_cache: Dict[int, Dict[str, Any]] = {}
+
+        # Items with a usable question, aligned row-for-row with the embedding matrix
+        self._valid_items = [item for item in self.dataset if item.get('qa', {}).get('question')]
+        self._valid_questions = [item['qa']['question'] for item in self._valid_items]
+        self._lexical_questions = [question.lower() for question in self._valid_questions] # Lowercased once for fuzzy matching
+        self.embedding_model = embedding_model
+        self._encoder = self._load_encoder(embedding_model)
+        question_embeddings = self._build_question_embeddings()
+        self.question_index = self._build_index(question_embeddings)
+        # Without FAISS, questions are searched as int8 codes with a per-row scale, a quarter of the float32 footprint
+        self.question_codes, self.question_scales = (
+            (None, None) if self.question_index is not None else self._quantize(question_embeddings)
+        )
 
     def _load_dataset(self) -> List[Dict]:
-        """Load the training dataset from JSON file"""
+        """Load the training dataset from a JSON array or JSON lines file"""
         try:
-            with open(self.dataset_path, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if not content: # Handle empty file
+            with open(self.dataset_path, 'rb') as f:
+                first_char = f.read(1)
+                while first_char.isspace():
+                    first_char = f.read(1)
+                if not first_char: # Handle empty file
                     print(f"Warning: Dataset file {self.dataset_path} is empty.")
                     return self._get_sample_data()
-                
-                if content.startswith('['):
-                    return json.loads(content)
-                else:
-                    data = []
-                    for line in content.split('\n'):
-                        if line.strip():
-                            data.append(json.loads(line))
-                    return data
+
+                if first_char == b'[':
+                    # Parse straight from the page cache instead of copying the file into a str first
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                        return orjson.loads(view)
+
+                f.seek(0)
+                return [orjson.loads(line) for line in f if line.strip()]
         except FileNotFoundError:
             print(f"Warning: Dataset file {self.dataset_path} not found. Using sample data.")
             return self._get_sample_data()
-        except json.JSONDecodeError as e:
+        except json.JSONDecodeError as e: # orjson.JSONDecodeError subclasses it
             print(f"Error decoding JSON from {self.dataset_path}: {e}. Using sample data.")
             return self._get_sample_data()
 
+    @staticmethod
+    def _prepare_item(item: Dict) -> None:
+        """Materialize the joined text and formatted table once instead of on every lookup"""
+        item['_pre_text_joined'] = ' '.join(item.get('pre_text', []))
+        item['_post_text_joined'] = ' '.join(item.get('post_text', []))
+        item['_table_formatted'] = format_table(item.get('table_ori', item.get('table', [])))
+
     def _get_sample_data(self) -> List[Dict]:
         """Provides sample data if main dataset fails to load."""
         return [{
@@ -51,40 +116,186 @@ class FinancialRAGSystem:
             "filename": "sample_file.pdf"
         }]
 
-    def calculate_similarity(self, query1: str, query2: str) -> float:
-        return SequenceMatcher(None, query1.lower(), query2.lower()).ratio()
+    def _load_encoder(self, model_name: Optional[str]):
+        """Load the sentence-transformers encoder, or None to fall back to lexical matching"""
+        if not model_name:
+            return None
+        if SentenceTransformer is None:
+            print("Warning: sentence-transformers not installed, using lexical similarity. "
+                  "Install with: pip install sentence-transformers")
+            return None
+        try:
+            return SentenceTransformer(model_name)
+        except Exception as e:
+            print(f"Warning: Could not load embedding model {model_name}: {e}. Using lexical similarity.")
+            return None
+
+    def _embedding_cache_path(self) -> Optional[str]:
+        """Cache file for the question embeddings, keyed by dataset mtime/size and model name"""
+        try:
+            stat = os.stat(self.dataset_path)
+        except OSError: # Sample data has no backing file worth caching
+            return None
+        # Fingerprinting from stat avoids hashing the whole dataset on every startup
+        fingerprint = f"{self.embedding_model}|{os.path.abspath(self.dataset_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+        digest = hashlib.sha1(fingerprint.encode('utf-8'))
+        return os.path.join(RAG_CACHE_DIR, f"finqa_questions_{digest.hexdigest()[:16]}.npy")
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Embed texts as L2-normalized float32 rows so a dot product is cosine similarity"""
+        return self._encoder.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+    def encode_batch(self, texts: List[str]) -> Optional[np.ndarray]:
+        """Embed texts in one encoder call, or return None when no embedding model is loaded"""
+        if self._encoder is None:
+            return None
+        return self._encode(texts)
 
-    def find_similar_query(self, user_query: str, top_k: int = 1) -> List[Dict]:
-        if not self.dataset: # Handle case where dataset is empty even after load attempt
+    def _build_question_embeddings(self) -> Optional[np.ndarray]:
+        """Embed every dataset question once, reusing the on-disk cache across restarts"""
+        if self._encoder is None or not self._valid_items:
+            return None
+
+        cache_path = self._embedding_cache_path()
+        if cache_path and os.path.exists(cache_path):
+            # Memory-mapped so the matrix is paged in from the file instead of copied into RAM
+            embeddings = np.load(cache_path, mmap_mode='r')
+            if embeddings.shape[0] == len(self._valid_items):
+                return embeddings
+
+        embeddings = self._encode(self._valid_questions)
+        if cache_path:
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                # Written under a temporary name and renamed, so a concurrent reader never sees half a file
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, embeddings)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                print(f"Warning: Could not cache question embeddings to {cache_path}: {e}")
+        return embeddings
+
+    def _build_index(self, embeddings: Optional[np.ndarray]):
+        """Inner-product FAISS index over the normalized question embeddings, if FAISS is installed.
+
+        Vectors are stored as 8-bit scalar-quantized codes, a quarter of the float32 size,
+        and scored with FAISS's SIMD distance kernels. The built index is saved next to the
+        embedding cache so later starts read it back instead of re-training and re-linking.
+        """
+        if embeddings is None or faiss is None:
+            return None
+        use_hnsw = len(embeddings) >= _HNSW_MIN_ITEMS
+        cache_path = self._embedding_cache_path()
+        if cache_path:
+            kind = f"hnswsq8_m{_HNSW_NEIGHBORS}_efc{_HNSW_EF_CONSTRUCTION}" if use_hnsw else "sq8"
+            cache_path = f"{os.path.splitext(cache_path)[0]}_{kind}.faiss"
+            if os.path.exists(cache_path):
+                try:
+                    index = faiss.read_index(cache_path)
+                    if index.ntotal == len(embeddings):
+                        if use_hnsw:
+                            index.hnsw.efSearch = RAG_HNSW_EF_SEARCH
+                        return index
+                except RuntimeError as e: # FAISS reports unreadable files as RuntimeError
+                    print(f"Warning: Could not read cached index {cache_path}: {e}. Rebuilding.")
+
+        dim = embeddings.shape[1]
+        if not use_hnsw:
+            # A linear scan is cheaper than graph traversal at this size
+            index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, _HNSW_NEIGHBORS, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = _HNSW_EF_CONSTRUCTION
+            index.hnsw.efSearch = RAG_HNSW_EF_SEARCH
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        index.train(vectors) # Learns the per-dimension ranges the 8-bit codes cover
+        index.add(vectors)
+        if cache_path:
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                faiss.write_index(index, tmp_path)
+                os.replace(tmp_path, cache_path)
+            except (OSError, RuntimeError) as e:
+                print(f"Warning: Could not cache question index to {cache_path}: {e}")
+        return index
+
+    @staticmethod
+    def _quantize(embeddings: Optional[np.ndarray]):
+        """Symmetric int8 quantization with one scale per row, so row ≈ codes * scale"""
+        if embeddings is None:
+            return None, None
+        scales = np.abs(embeddings).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0 # All-zero rows quantize to zeros instead of dividing by zero
+        codes = np.round(embeddings / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def find_similar_query(self, user_query: str, top_k: int = 1, ef_search: Optional[int] = None) -> List[Tuple[float, Dict]]:
+        """Return the top_k (similarity, item) pairs, best match first.
+
+        ef_search overrides the HNSW search breadth for this query (higher = better recall, slower);
+        it is ignored by the exact and lexical searches.
+        """
+        if not self.dataset or top_k <= 0: # Handle case where dataset is empty even after load attempt
             return []
-            
-        similarities = []
-        for item in self.dataset:
-            if 'qa' in item and 'question' in item['qa'] and item['qa']['question']: # Ensure question is not empty
-                similarity = self.calculate_similarity(user_query, item['qa']['question'])
-                similarities.append({
-                    'similarity': similarity,
-                    'item': item
-                })
-        
-        similarities.sort(key=lambda x: x['similarity'], reverse=True)
-        return [s['item'] for s in similarities[:top_k]] # Return items directly
+
+        if self.question_index is not None:
+            # One SIMD scan returns the top-k scores and row ids together
+            params = None
+            if ef_search and isinstance(self.question_index, faiss.IndexHNSW):
+                params = faiss.SearchParametersHNSW(efSearch=max(ef_search, top_k))
+            scores, indices = self.question_index.search(
+                self._encode([user_query]), min(top_k, self.question_index.ntotal), params=params)
+            return [(float(score), self._valid_items[i]) for score, i in zip(scores[0], indices[0]) if i >= 0]
+
+        if self.question_codes is not None:
+            # Integer dot products against all question codes, rescaled to cosine, then partial sort for the top-k
+            query_codes, query_scales = self._quantize(self._encode([user_query]))
+            scores = np.einsum('ij,j->i', self.question_codes, query_codes[0].astype(np.int32))
+            scores = scores * (self.question_scales * query_scales[0])
+            top_k = min(top_k, len(scores))
+            top_indices = np.argpartition(-scores, top_k - 1)[:top_k]
+            top_indices = top_indices[np.argsort(-scores[top_indices])]
+            return [(float(scores[i]), self._valid_items[i]) for i in top_indices]
+
+        # C++ Indel ratio (same [0, 1] scale as difflib) over the lowercased questions prepared at load time
+        query = user_query.lower()
+        similarities = (
+            (fuzz.ratio(query, question) / 100.0, item)
+            for question, item in zip(self._lexical_questions, self._valid_items)
+        )
+        # Keeps only a k-sized heap instead of sorting every score
+        return heapq.nlargest(top_k, similarities, key=itemgetter(0))
 
     def extract_context_from_item(self, item: Dict) -> Dict[str, Any]: # Renamed for clarity
-        """Extract relevant context from a single dataset item"""
+        """Extract relevant context from a single dataset item, memoized per item"""
+        context = self._context_cache.get(id(item)) # Items live as long as self.dataset, so ids are stable
+        if context is None:
+            context = self._context_cache[id(item)] = self._build_context(item)
+        return context
+
+    def _build_context(self, item: Dict) -> Dict[str, Any]:
         return {
             'question': item.get('qa', {}).get('question', 'N/A'),
             'answer': item.get('qa', {}).get('answer', 'N/A'),
             'program': item.get('qa', {}).get('program', 'N/A'),
-            'pre_text': ' '.join(item.get('pre_text', [])),
-            'post_text': ' '.join(item.get('post_text', [])),
+            'pre_text': item['_pre_text_joined'],
+            'post_text': item['_post_text_joined'],
             'table_data': item.get('table_ori', item.get('table', [])),
+            'formatted_table': item['_table_formatted'],
             'filename': item.get('filename', 'Unknown')
         }
 
-# Global instance (or manage instantiation differently, e.g., in main.py)
-# For simplicity in tool definition, a global instance can work for this prototype.
-# from .config import DATASET_PATH # If DATASET_PATH is needed here
-# rag_system_instance = FinancialRAGSystem(dataset_path=DATASET_PATH)
-# However, it's cleaner to pass the instance to the tool if the tool is not defined in the same file.
-# Let's plan to instantiate it in main.py and pass it to the tool creator.
\ No newline at end of file
+@functools.lru_cache(maxsize=1)
+def _get_rag_system(dataset_path: str) -> FinancialRAGSystem:
+    return FinancialRAGSystem(dataset_path=dataset_path)
+
+def get_rag_system(dataset_path: str) -> FinancialRAGSystem:
+    """Process-wide RAG system for a dataset, so the dataset and index load once per process.
+
+    Lookups only read the index (the context cache is a plain dict filled under the GIL),
+    so threads in the process can share it. Separate processes, e.g. pytest-xdist workers,
+    each get their own instance backed by the shared on-disk cache.
+    """
+    return _get_rag_system(os.path.abspath(dataset_path))
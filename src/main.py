@@ -1,14 +1,36 @@
 # src/main.py
+import asyncio
+import logging
 import os # Already imported in config, but good for explicitness
 
 from langchain_openai import ChatOpenAI
-from .config import get_llm_config, DATASET_PATH # Use your config module
-from .finqa_rag import FinancialRAGSystem
+from .config import StreamBuffer, get_llm_config, DATASET_PATH, LOG_LEVEL, RESPONSE_CACHE_PATH, RESPONSE_CACHE_THRESHOLD # Use your config module
+from .finqa_rag import get_rag_system
+from .response_cache import SemanticResponseCache
 from .tools import create_financial_context_lookup_tool, calculator # calculator is directly usable
 from .agents import create_math_agent, create_financial_research_agent
-from .workflow import create_application_workflow
+from .workflow import create_application_workflow, is_agent_error
 
-def run_chat_interface():
+def _cacheable_answer(values) -> str:
+    """Last assistant message in a thread's state, or "" when there is none or the turn failed"""
+    messages = values.get("messages") or []
+    if not messages or messages[-1].get("role") != "assistant":
+        return ""
+    content = messages[-1].get("content") or ""
+    # A failed agent call (timeout, server down) must not be replayed as the answer from now on
+    return "" if is_agent_error(content) else content
+
+def _cache_fingerprint(model_name: str, dataset_path: str) -> str:
+    """Identifies the model and dataset version behind cached answers, so changing either drops them"""
+    try:
+        stat = os.stat(dataset_path)
+        dataset = f"{os.path.abspath(dataset_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+    except OSError: # Sample data fallback
+        dataset = os.path.abspath(dataset_path)
+    return f"{model_name}|{dataset}"
+
+async def arun_chat_interface():
+    logging.basicConfig(level=LOG_LEVEL, format="%(message)s")
     print("Initializing Financial Chat System...")
 
     # 1. Initialize LLM
@@ -16,7 +38,7 @@ def run_chat_interface():
     llm = ChatOpenAI(**llm_configs)
 
     # 2. Initialize RAG System
-    rag_system_instance = FinancialRAGSystem(dataset_path=DATASET_PATH)
+    rag_system_instance = get_rag_system(DATASET_PATH)
 
     # 3. Create Tools
     # Calculator tool is already defined and decorated with @tool
@@ -30,6 +52,14 @@ def run_chat_interface():
     # 5. Create Workflow
     app = create_application_workflow(llm, math_agent_instance, financial_agent_instance)
 
+    # 6. Reuse answers for repeated or paraphrased questions instead of re-running the agents
+    response_cache = SemanticResponseCache(
+        encode=rag_system_instance.encode_batch,
+        threshold=RESPONSE_CACHE_THRESHOLD,
+        cache_path=RESPONSE_CACHE_PATH,
+        fingerprint=_cache_fingerprint(llm_configs['model'], DATASET_PATH),
+    )
+
     print("Welcome to the LangGraph Supervisor Chat!")
     print("Ask financial questions or math problems.")
     print("Type 'quit' or 'exit' to end the conversation.\n")
@@ -40,8 +70,10 @@ def run_chat_interface():
     config = {"configurable": {"thread_id": session_id}}
     print(f"Session ID: {session_id}")
 
+    loop = asyncio.get_running_loop()
     while True:
-        user_input = input("You: ")
+        # Read input off the event loop so it stays free for in-flight work
+        user_input = await loop.run_in_executor(None, input, "You: ")
         if user_input.lower() in ['quit', 'exit']:
             print("Goodbye!")
             break
@@ -49,15 +81,35 @@ def run_chat_interface():
         if not user_input.strip():
             continue
 
+        # The cache is keyed by the question alone, so only a thread's first turn can be answered from it
+        first_turn = not (await app.aget_state(config)).values
+        cached_response = response_cache.lookup(user_input) if first_turn else None
+        if cached_response is not None:
+            print(f"Assistant: {cached_response}\n")
+            # Record the replayed turn in the thread so follow-up questions still see it
+            await app.aupdate_state(config, {
+                "messages": [{"role": "user", "content": user_input},
+                             {"role": "assistant", "content": cached_response}],
+                "next_agent": "END",
+            }, as_node="math_expert")
+            continue
+
         try:
 
             print("Assistant: ", end="", flush=True)  
-            for msg, metadata in app.stream({  
-                "messages": [{"role": "user", "content": user_input}]  
-            }, config, stream_mode="messages"):  
-                if hasattr(msg, 'content') and msg.content:  
-                    print(msg.content, end="", flush=True)
+            output = StreamBuffer()
+            try:
+                async for msg, metadata in app.astream({  
+                    "messages": [{"role": "user", "content": user_input}]  
+                }, config, stream_mode="messages"):  
+                    if hasattr(msg, 'content') and msg.content:  
+                        output.write(msg.content)
+            finally:
+                output.flush()
             print("\n")  # New line after streaming completes  
+            if first_turn:
+                # Cache the final assistant message, not the streamed tool output that led to it
+                response_cache.add(user_input, _cacheable_answer((await app.aget_state(config)).values))
 
         except Exception as e:
             print(f"\nError during stream: {e}")
@@ -65,6 +117,9 @@ def run_chat_interface():
             traceback.print_exc()
             print()
 
+def run_chat_interface():
+    asyncio.run(arun_chat_interface())
+
 if __name__ == "__main__":
     # This allows running main.py directly from the src directory or project root
     # For running from project root: python -m src.main
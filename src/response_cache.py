@@ -0,0 +1,97 @@
+# src/response_cache.py
+import json
+import os
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    return ' '.join(query.lower().split())
+
+
+class SemanticResponseCache:
+    """Replays final answers for questions that were already answered.
+
+    With an encoder, a question hits when its cosine similarity to a cached
+    question reaches `threshold`; without one, only the normalized text must match.
+    `fingerprint` identifies what produced the answers (model, dataset); a cache file
+    saved under a different fingerprint is discarded on load.
+    """
+
+    def __init__(self, encode: Optional[Callable[[List[str]], Optional[np.ndarray]]] = None,
+                 threshold: float = 0.92, cache_path: Optional[str] = None, fingerprint: str = ""):
+        self.encode = encode
+        self.threshold = threshold
+        self.cache_path = cache_path
+        self.fingerprint = fingerprint
+        self._queries: List[str] = []
+        self._responses: List[str] = []
+        self._exact: Dict[str, int] = {} # normalized query -> row
+        self._embeddings: Optional[np.ndarray] = None # (N, d) L2-normalized rows
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._queries)
+
+    def lookup(self, query: str) -> Optional[str]:
+        """Return the cached response for `query`, or None on a miss"""
+        row = self._exact.get(normalize_query(query))
+        if row is not None:
+            return self._responses[row]
+        if self._embeddings is None or not len(self._embeddings):
+            return None
+
+        embedding = self.encode([query])[0]
+        scores = self._embeddings @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            return self._responses[best]
+        return None
+
+    def add(self, query: str, response: str) -> None:
+        """Store the final response for `query` and persist the cache"""
+        if not response.strip():
+            return
+        self._insert([query], [response])
+        self._save()
+
+    def _insert(self, queries: List[str], responses: List[str]) -> None:
+        for query in queries:
+            self._exact[normalize_query(query)] = len(self._queries)
+            self._queries.append(query)
+        self._responses.extend(responses)
+
+        embeddings = self.encode(queries) if self.encode else None
+        if embeddings is not None:
+            self._embeddings = embeddings if self._embeddings is None else np.vstack([self._embeddings, embeddings])
+
+    def _load(self) -> None:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Warning: Could not load response cache from {self.cache_path}: {e}")
+            return
+        if not isinstance(saved, dict) or saved.get('fingerprint') != self.fingerprint:
+            print(f"Response cache at {self.cache_path} was built for another model or dataset; starting empty")
+            return
+        entries = saved.get('entries')
+        if entries:
+            self._insert([e['query'] for e in entries], [e['response'] for e in entries])
+
+    def _save(self) -> None:
+        if not self.cache_path:
+            return
+        saved = {
+            'fingerprint': self.fingerprint,
+            'entries': [{'query': q, 'response': r} for q, r in zip(self._queries, self._responses)],
+        }
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump(saved, f, ensure_ascii=False)
+        except OSError as e:
+            print(f"Warning: Could not save response cache to {self.cache_path}: {e}")
@@ -1,8 +1,73 @@
 # src/tools.py
+import ast
+import asyncio
+import functools
+import logging
 import math
-import re
-from langchain_core.tools import tool # Using the decorator for cleaner definition
+import operator
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Dict, List, Optional
+from langchain_core.tools import StructuredTool, tool # Using the decorator for cleaner definition
 from .finqa_rag import FinancialRAGSystem # Assuming rag_system.py is in the same directory
+from .response_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+_MAX_RESULT_DIGITS = 10000 # Keeps "9**9**9"-style inputs from hanging the agent
+
+def _checked_pow(base, exponent, modulus=None):
+    """pow() that refuses results longer than _MAX_RESULT_DIGITS digits before computing them"""
+    # Only positive exponents grow the result; negative ones shrink it toward 0
+    if modulus is None and exponent > 0 and abs(base) > 1 and exponent * math.log10(abs(base)) > _MAX_RESULT_DIGITS:
+        raise ValueError(f"{base}**{exponent} is too large")
+    return pow(base, exponent) if modulus is None else pow(base, exponent, modulus)
+
+# Whitelisted operators, functions and constants for the calculator's AST evaluator,
+# built once at import and read-only so nothing can widen the whitelist at runtime
+_BINARY_OPS = MappingProxyType({
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: _checked_pow,
+})
+_UNARY_OPS = MappingProxyType({ast.UAdd: operator.pos, ast.USub: operator.neg})
+_SAFE_FUNCTIONS = MappingProxyType({
+    "abs": abs, "round": round, "min": min, "max": max, "sum": sum,
+    "sqrt": math.sqrt, "sin": math.sin, "cos": math.cos, "tan": math.tan,
+    "asin": math.asin, "acos": math.acos, "atan": math.atan, "log": math.log,
+    "log10": math.log10, "exp": math.exp, "pow": _checked_pow, "floor": math.floor,
+    "ceil": math.ceil,
+})
+_SAFE_CONSTANTS = MappingProxyType({"pi": math.pi, "e": math.e})
+
+@functools.lru_cache(maxsize=512)
+def _parse_expression(expression: str) -> ast.expr:
+    """Parse once per distinct expression; agent retries reuse the cached tree"""
+    return ast.parse(expression, mode='eval').body
+
+def _evaluate_node(node: ast.AST):
+    """Evaluate a parsed expression, rejecting anything outside the whitelist"""
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return node.value
+        raise ValueError(f"unsupported constant {node.value!r}")
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+        return _BINARY_OPS[type(node.op)](_evaluate_node(node.left), _evaluate_node(node.right))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        return _UNARY_OPS[type(node.op)](_evaluate_node(node.operand))
+    if isinstance(node, ast.Name):
+        if node.id in _SAFE_CONSTANTS:
+            return _SAFE_CONSTANTS[node.id]
+        raise NameError(f"name '{node.id}' is not defined")
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in _SAFE_FUNCTIONS:
+            name = node.func.id if isinstance(node.func, ast.Name) else type(node.func).__name__
+            raise NameError(f"function '{name}' is not allowed")
+        args = [_evaluate_node(arg) for arg in node.args]
+        kwargs = {kw.arg: _evaluate_node(kw.value) for kw in node.keywords if kw.arg is not None}
+        return _SAFE_FUNCTIONS[node.func.id](*args, **kwargs)
+    if isinstance(node, (ast.Tuple, ast.List)): # e.g. sum([1, 2, 3])
+        return tuple(_evaluate_node(element) for element in node.elts)
+    raise ValueError(f"unsupported syntax '{type(node).__name__}'")
 
 # Calculator tool (largely same, but with @tool decorator)
 @tool
@@ -15,40 +80,9 @@ def calculator(expression: str) -> str:
     """
     try:
         expression = expression.strip().lower() # Normalize
-        expression = expression.replace('pi', str(math.pi))
-        expression = expression.replace('e', str(math.e))
-
-        safe_dict = {
-            "__builtins__": {}, "abs": abs, "round": round, "min": min, "max": max, "sum": sum,
-            "sqrt": math.sqrt, "sin": math.sin, "cos": math.cos, "tan": math.tan,
-            "asin": math.asin, "acos": math.acos, "atan": math.atan, "log": math.log,
-            "log10": math.log10, "exp": math.exp, "pow": pow, "floor": math.floor,
-            "ceil": math.ceil, "pi": math.pi, "e": math.e,
-        }
-        
-        dangerous_patterns = [r'__\w+__', r'import\s+', r'exec\s*\(', r'eval\s*\(', r'open\s*\(', r'input\s*\(']
-        for pattern in dangerous_patterns:
-            if re.search(pattern, expression): # Removed re.IGNORECASE as expression is lowercased
-                return "Error: Invalid expression - contains potentially dangerous operations."
-        
-        # Simple check for letters not part of functions/constants
-        # This is heuristic and might need refinement for more complex valid expressions
-        allowed_chars_in_expr = "0123456789+-*/()., " # Added comma for potential large numbers
-        processed_expr = expression
-        for func_name in safe_dict.keys():
-            if func_name not in ["__builtins__", "pi", "e"]: # Avoid replacing constants that are part of other names
-                 processed_expr = processed_expr.replace(func_name, "") # Remove function names for check
-        
-        for char_to_remove in ["pi", "e"]: # Remove constants
-             processed_expr = processed_expr.replace(char_to_remove, "")
-
-        if any(char.isalpha() for char in processed_expr):
-            # Check if remaining alpha chars are from numbers like 1e5 (scientific notation)
-            if not re.fullmatch(r'[0-9eE\.\+\-\s]*', processed_expr.replace(' ','')): # allow e/E for sci notation
-                 return f"Error: Invalid expression - contains unrecognized characters or variable names: '{expression}'"
 
-
-        result = eval(expression, {"__builtins__": {}}, safe_dict) # Pass safe_dict as globals
+        # Only whitelisted AST nodes are evaluated, so no builtins or attributes are reachable
+        result = _evaluate_node(_parse_expression(expression))
         
         if isinstance(result, float):
             return f"{result:.10g}" if not result.is_integer() else str(int(result))
@@ -60,90 +94,33 @@ def calculator(expression: str) -> str:
     except NameError as e: return f"Error: Unrecognized name or function in expression: {str(e)}"
     except Exception as e: return f"Error calculating '{expression}': {str(e)}."
 
-# Financial Context Lookup Tool
-# This function will now be a factory that takes the rag_system instance
-def create_financial_context_lookup_tool(rag_system_instance: FinancialRAGSystem):
-    @tool
-    def financial_context_lookup(query: str) -> str: # Keep return type as str for now, as per user's request to keep code unchanged
-        """
-        Look up similar financial queries and retrieve relevant context.
-        Searches a dataset of financial Q&A to find similar queries, then provides
-        context (tables, text) for financial calculations. Use this first for specific financial data questions.
-        """
-        try:
-            print(f"\n🔍 Financial Context Lookup Debug:")
-            print(f"📝 Query: {query}")
-            
-            # Get top 3 for debugging, but only use the best match for context
-            all_similar_items = rag_system_instance.find_similar_query(query, top_k=3)
-            
-            if not all_similar_items:
-                print("⚠️  No similar queries found in the financial dataset.")
-                return "No similar queries found in the financial dataset."
-            
-            print(f"🎯 Found {len(all_similar_items)} similar items:")
-            for i, item in enumerate(all_similar_items):
-                item_question = item.get('qa', {}).get('question', '')
-                item_answer = item.get('qa', {}).get('answer', '')
-                similarity = rag_system_instance.calculate_similarity(query, item_question)
-                print(f"   {i+1}. Similarity: {similarity:.3f} | Q: {item_question[:70]}... | A: {item_answer[:50]}...")
-            
-            best_match_item = all_similar_items[0]
-            similarity_score = rag_system_instance.calculate_similarity(query, best_match_item.get('qa', {}).get('question', ''))
-            context = rag_system_instance.extract_context_from_item(best_match_item)
-            
-            print(f"✅ Using best match with similarity: {similarity_score:.3f}")
-            print(f"Full Context for Best Match:")
-            print(f"  Dataset Question: {context['question']}")
-            print(f"  Dataset Answer: {context['answer']}")
-            print(f"  Dataset Program: {context['program']}")
-            print(f"  Filename: {context['filename']}")
-            print(f"  Pre-text (first 300 chars): {context['pre_text'][:300]}...")
-            
-            table_str = "No table data available."
-            if context['table_data']:
-                print(f"  📊 Table data found: {len(context['table_data'])} rows")
-                table_str = "\n"
-                for i, row in enumerate(context['table_data']): # Print all rows for debugging
-                    table_str += f"    Row {i+1}: {row}\n"
-                    
-                # Extract key numerical data for validation
-                print(f"🔍 DATA VALIDATION - Key numbers found in table:")
-                for i, row in enumerate(context['table_data']):
-                    if len(row) >= 3 and any(char.isdigit() for char in str(row[0])):
-                        print(f"     {row[0]}: {row[1:] if len(row) > 1 else 'No values'}")
-            else:
-                print("  ⚠️  No table data found in context")
+def _batch_calculate(expressions: List[str]) -> List[str]:
+    """
+    Calculate several independent expressions in one tool call.
+    Returns one result (or error message) per expression, in the same order.
+    Example: ["((206588 - 181001) / 181001) * 100", "((181001 - 174247) / 174247) * 100"]
+    """
+    return [calculator.invoke({"expression": e}) for e in expressions]
 
-            print(f"  Post-text (first 300 chars): {context['post_text'][:300]}...")
+async def _abatch_calculate(expressions: List[str]) -> List[str]:
+    # Evaluated concurrently so the agent needs one round-trip instead of one per expression
+    return list(await asyncio.gather(*[calculator.ainvoke({"expression": e}) for e in expressions]))
 
-            # Improve table formatting for clearer data extraction
-            formatted_table = "No table data available."
-            if context['table_data']:
-                formatted_table = "\n"
-                for i, row in enumerate(context['table_data']):
-                    # Format each row clearly
-                    if len(row) > 1:
-                        row_label = str(row[0]) if row[0] else f"Row {i+1}"
-                        row_values = [str(cell) for cell in row[1:] if cell]
-                        if row_values:
-                            formatted_table += f"  • {row_label}: {' | '.join(row_values)}\n"
-                    else:
-                        formatted_table += f"  • {' | '.join(str(cell) for cell in row if cell)}\n"
-
-            # Add explicit year mapping for clarity
-            year_headers = ""
-            if context['table_data'] and len(context['table_data']) > 0:
-                # Try to find year information from headers
-                header_row = context['table_data'][0] if context['table_data'] else []
-                if any('2009' in str(cell) or '2008' in str(cell) or '2007' in str(cell) for cell in header_row):
-                    year_headers = f"\nYEAR MAPPING FROM TABLE HEADERS: {header_row}"
-
-            response = f"""
+batch_calculator = StructuredTool.from_function(
+    func=_batch_calculate,
+    coroutine=_abatch_calculate,
+    name="batch_calculator",
+)
+
+# Shared by every lookup tool so concurrent sessions don't each spawn threads for retrieval
+_RAG_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rag")
+
+# Prompt returned by financial_context_lookup, built once at import and filled per call
+_RESPONSE_TMPL = """
 ⚠️  CRITICAL DATA EXTRACTION TASK ⚠️
 
-REFERENCE ANSWER: {context['answer']} (from dataset)
-REFERENCE CALCULATION: {context['program']} (from dataset)
+REFERENCE ANSWER: {answer} (from dataset)
+REFERENCE CALCULATION: {program} (from dataset)
 
 🔍 EXACT TABLE DATA TO EXTRACT FROM:
 {formatted_table}{year_headers}
@@ -156,17 +133,106 @@ REFERENCE CALCULATION: {context['program']} (from dataset)
 5. If you use numbers like 125,000,000 or 1,250,000 you are WRONG
 
 📝 SUPPORTING CONTEXT:
-Pre-text: {context['pre_text']}
-Post-text: {context['post_text']}
+Pre-text: {pre_text}
+Post-text: {post_text}
 
 USER QUERY: '{query}'
 
 ⚠️  BEFORE YOU ANSWER: Copy the exact row from the table that contains your metric and state which column corresponds to which year.
-"""
-            return response.strip()
-            
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
+""".strip() # Stripped once here instead of on every formatted response
+
+# Financial Context Lookup Tool
+# This function will now be a factory that takes the rag_system instance
+def create_financial_context_lookup_tool(rag_system_instance: FinancialRAGSystem):
+    # Repeated queries (agent retries, re-asked questions) reuse the retrieved context. Keyed by the
+    # normalized query, so case and spacing differences still hit; the caller's query is filled in per call
+    @functools.lru_cache(maxsize=1024)
+    def _retrieve_cached(query: str) -> Optional[Dict[str, str]]:
+        logger.debug("🔍 Financial Context Lookup Debug:")
+        logger.debug("📝 Query: %s", query)
+        
+        # Get top 3 for debugging, but only use the best match for context
+        all_similar_items = rag_system_instance.find_similar_query(query, top_k=3)
+        
+        if not all_similar_items:
+            logger.warning("⚠️  No similar queries found in the financial dataset.")
+            return None
+        
+        if logger.isEnabledFor(logging.DEBUG): # Scores come from the search itself, nothing is re-encoded here
+            logger.debug("🎯 Found %d similar items:", len(all_similar_items))
+            for i, (similarity, item) in enumerate(all_similar_items):
+                item_question = item.get('qa', {}).get('question', '')
+                item_answer = item.get('qa', {}).get('answer', '')
+                logger.debug("   %d. Similarity: %.3f | Q: %.70s... | A: %.50s...", i+1, similarity, item_question, item_answer)
+        
+        similarity_score, best_match_item = all_similar_items[0]
+        context = rag_system_instance.extract_context_from_item(best_match_item)
+        
+        if logger.isEnabledFor(logging.DEBUG): # Row stringification only runs when it will be logged
+            logger.debug("✅ Using best match with similarity: %.3f", similarity_score)
+            logger.debug("Full Context for Best Match:")
+            logger.debug("  Dataset Question: %s", context['question'])
+            logger.debug("  Dataset Answer: %s", context['answer'])
+            logger.debug("  Dataset Program: %s", context['program'])
+            logger.debug("  Filename: %s", context['filename'])
+            logger.debug("  Pre-text (first 300 chars): %.300s...", context['pre_text'])
+
+            if context['table_data']:
+                logger.debug("  📊 Table data found: %d rows", len(context['table_data']))
+                table_str = "\n" + "".join(f"    Row {i+1}: {row}\n" for i, row in enumerate(context['table_data']))
+                logger.debug("  Table rows:%s", table_str)
+
+                # Extract key numerical data for validation
+                logger.debug("🔍 DATA VALIDATION - Key numbers found in table:")
+                for i, row in enumerate(context['table_data']):
+                    if len(row) >= 3 and any(char.isdigit() for char in str(row[0])):
+                        logger.debug("     %s: %s", row[0], row[1:] if len(row) > 1 else 'No values')
+            else:
+                logger.debug("  ⚠️  No table data found in context")
+
+            logger.debug("  Post-text (first 300 chars): %.300s...", context['post_text'])
+
+        # Table rows are pre-formatted at dataset load time for clearer data extraction
+        formatted_table = context['formatted_table']
+
+        # Add explicit year mapping for clarity
+        year_headers = ""
+        if context['table_data'] and len(context['table_data']) > 0:
+            # Try to find year information from headers
+            header_row = context['table_data'][0] if context['table_data'] else []
+            if any('2009' in str(cell) or '2008' in str(cell) or '2007' in str(cell) for cell in header_row):
+                year_headers = f"\nYEAR MAPPING FROM TABLE HEADERS: {header_row}"
+
+        return {
+            'answer': context['answer'],
+            'program': context['program'],
+            'formatted_table': formatted_table,
+            'year_headers': year_headers,
+            'pre_text': context['pre_text'],
+            'post_text': context['post_text'],
+        }
+
+    def financial_context_lookup(query: str) -> str: # Keep return type as str for now, as per user's request to keep code unchanged
+        """
+        Look up similar financial queries and retrieve relevant context.
+        Searches a dataset of financial Q&A to find similar queries, then provides
+        context (tables, text) for financial calculations. Use this first for specific financial data questions.
+        """
+        try:
+            params = _retrieve_cached(normalize_query(query))
+            if params is None:
+                return "No similar queries found in the financial dataset."
+            return _RESPONSE_TMPL.format_map({**params, 'query': query})
+        except Exception as e: # Raised inside the cached body so errors are never cached
+            logger.exception("financial_context_lookup failed for query %r", query)
             return f"Error in financial_context_lookup: {str(e)}"
-    return financial_context_lookup
+
+    async def afinancial_context_lookup(query: str) -> str:
+        # The similarity scan is CPU-bound, so run it on the pool rather than blocking the event loop
+        return await asyncio.get_running_loop().run_in_executor(_RAG_POOL, financial_context_lookup, query)
+
+    return StructuredTool.from_function(
+        func=financial_context_lookup,
+        coroutine=afinancial_context_lookup,
+        name="financial_context_lookup",
+    )
@@ -11,7 +11,7 @@ parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, parent_dir)
 
 from src.config import get_llm_config
-from src.finqa_rag import FinancialRAGSystem
+from src.finqa_rag import get_rag_system
 from src.tools import create_financial_context_lookup_tool
 from src.agents import create_math_agent, create_financial_research_agent
 from src.workflow import create_application_workflow
@@ -25,7 +25,7 @@ def main():
     llm = ChatOpenAI(**llm_config)
     
     # Create a minimal RAG system for visualization
-    rag_system = FinancialRAGSystem('../data/train.json')
+    rag_system = get_rag_system('../data/train.json')
     financial_tool = create_financial_context_lookup_tool(rag_system)
     
     # Create agents
@@ -1,9 +1,24 @@
 # src/workflow.py
+from langchain_core.runnables import RunnableLambda
 from langchain_openai import ChatOpenAI
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph, START, END
 from typing import Dict, Any, List
 from dataclasses import dataclass
+from types import MappingProxyType
+
+# Phrase the financial agent's prompt tells it to end with when a calculation is needed
+_MATH_MARKER = "NEED_MATH_CALCULATION"
+
+# Start of the message a node returns in place of an answer when its agent raises
+_AGENT_ERROR_PREFIXES = ("Financial agent error:", "Math agent error:")
+
+# Run config shared by every agent call; read-only so one object can be reused safely
+_AGENT_CONFIG = MappingProxyType({"configurable": MappingProxyType({"thread_id": "workflow"})})
+
+def is_agent_error(content: str) -> bool:
+    """True for the placeholder a node returns when its agent call failed, which is never a real answer"""
+    return content.startswith(_AGENT_ERROR_PREFIXES)
 
 @dataclass
 class WorkflowState:
@@ -13,43 +28,62 @@ class WorkflowState:
 def create_application_workflow(llm: ChatOpenAI, math_agent, financial_agent):
     """Create a custom workflow that works reliably with small models"""
     
+    # The agents sit behind network-bound LLM calls, so each node has a sync body for invoke/stream
+    # and an async one for ainvoke/astream that lets concurrent sessions overlap their round-trips
+    def _append(state: WorkflowState, content: str, next_agent: str) -> WorkflowState:
+        # Copy instead of appending in place: state.messages is the caller's input list
+        # (e.g. the "messages" passed to invoke), and nodes must not mutate their input
+        new_messages = state.messages + [{"role": "assistant", "content": content}]
+        return WorkflowState(messages=new_messages, next_agent=next_agent)
+
+    def _last_content(result: Dict[str, Any]) -> str:
+        try:
+            return result['messages'][-1].content
+        except (IndexError, KeyError): # Agent returned no messages
+            return ""
+
+    def _after_financial(state: WorkflowState, result: Dict[str, Any]) -> WorkflowState:
+        response_content = _last_content(result)
+        
+        # Decide the route first, then build the message list once
+        next_agent = "math_expert" if _MATH_MARKER in response_content else "END"
+        return _append(state, response_content, next_agent)
+
+    def _after_math(state: WorkflowState, result: Dict[str, Any]) -> WorkflowState:
+        response_content = _last_content(result)
+        return _append(state, response_content, "END")
+
     def financial_node(state: WorkflowState) -> WorkflowState:
         """Handle financial research"""
         try:
-            config = {"configurable": {"thread_id": "workflow"}}
-            result = financial_agent.invoke({"messages": state.messages}, config)
-            
-            response_content = result['messages'][-1].content if result['messages'] else ""
-            
-            # Add response to messages
-            new_messages = state.messages + [{"role": "assistant", "content": response_content}]
-            
-            # Check if we need math calculation
-            if "NEED_MATH_CALCULATION" in response_content:
-                return WorkflowState(messages=new_messages, next_agent="math_expert")
-            else:
-                return WorkflowState(messages=new_messages, next_agent="END")
-                
+            result = financial_agent.invoke({"messages": state.messages}, _AGENT_CONFIG)
+            return _after_financial(state, result)
+        except Exception as e:
+            return _append(state, f"Financial agent error: {str(e)}", "END")
+
+    async def afinancial_node(state: WorkflowState) -> WorkflowState:
+        """Handle financial research without blocking the event loop"""
+        try:
+            result = await financial_agent.ainvoke({"messages": state.messages}, _AGENT_CONFIG)
+            return _after_financial(state, result)
         except Exception as e:
-            error_msg = f"Financial agent error: {str(e)}"
-            new_messages = state.messages + [{"role": "assistant", "content": error_msg}]
-            return WorkflowState(messages=new_messages, next_agent="END")
+            return _append(state, f"Financial agent error: {str(e)}", "END")
     
     def math_node(state: WorkflowState) -> WorkflowState:
         """Handle mathematical calculations"""
         try:
-            config = {"configurable": {"thread_id": "workflow"}}
-            result = math_agent.invoke({"messages": state.messages}, config)
-            
-            response_content = result['messages'][-1].content if result['messages'] else ""
-            new_messages = state.messages + [{"role": "assistant", "content": response_content}]
-            
-            return WorkflowState(messages=new_messages, next_agent="END")
-            
+            result = math_agent.invoke({"messages": state.messages}, _AGENT_CONFIG)
+            return _after_math(state, result)
+        except Exception as e:
+            return _append(state, f"Math agent error: {str(e)}", "END")
+
+    async def amath_node(state: WorkflowState) -> WorkflowState:
+        """Handle mathematical calculations without blocking the event loop"""
+        try:
+            result = await math_agent.ainvoke({"messages": state.messages}, _AGENT_CONFIG)
+            return _after_math(state, result)
         except Exception as e:
-            error_msg = f"Math agent error: {str(e)}"
-            new_messages = state.messages + [{"role": "assistant", "content": error_msg}]
-            return WorkflowState(messages=new_messages, next_agent="END")
+            return _append(state, f"Math agent error: {str(e)}", "END")
     
     def route_next(state: WorkflowState) -> str:
         """Simple routing logic"""
@@ -57,8 +91,8 @@ def create_application_workflow(llm: ChatOpenAI, math_agent, financial_agent):
     
     # Create the workflow graph
     workflow = StateGraph(WorkflowState)
-    workflow.add_node("financial_research_expert", financial_node)
-    workflow.add_node("math_expert", math_node)
+    workflow.add_node("financial_research_expert", RunnableLambda(financial_node, afunc=afinancial_node))
+    workflow.add_node("math_expert", RunnableLambda(math_node, afunc=amath_node))
     
     # Set entry point
     workflow.add_edge(START, "financial_research_expert")
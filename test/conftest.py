@@ -2,25 +2,55 @@
 Pytest configuration and shared fixtures
 """
 
+import asyncio
 import sys
 import os
+from contextlib import contextmanager
+
 import pytest
 
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
 # Add project root to path for module imports
 project_root = os.path.dirname(os.path.dirname(__file__))
 sys.path.insert(0, project_root)
 
-from src.config import get_llm_config, DATASET_PATH
-from src.finqa_rag import FinancialRAGSystem  
-from src.tools import create_financial_context_lookup_tool
-from src.agents import create_math_agent, create_financial_research_agent
-from src.workflow import create_application_workflow
-from langchain_openai import ChatOpenAI
+from src.config import get_llm_config, DATASET_PATH, RAG_CACHE_DIR
+
+
+@contextmanager
+def _rag_build_lock():
+    """Serialize the first RAG build across pytest-xdist workers.
+    
+    The first worker embeds the dataset and writes the on-disk cache while the others wait,
+    then they load that cache instead of each re-embedding every question.
+    """
+    if fcntl is None: # Not available on Windows; workers just build independently
+        yield
+        return
+    os.makedirs(RAG_CACHE_DIR, exist_ok=True)
+    with open(os.path.join(RAG_CACHE_DIR, ".build.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
 
 
 @pytest.fixture(scope="session")
 def finqa_app():
     """Initialize the FinQA system components (session-scoped fixture)"""
+    # Imported here so collection and app-free runs (e.g. `-k test_percentage_extraction`)
+    # don't pay for loading langchain and the RAG stack
+    from langchain_openai import ChatOpenAI
+    from src.finqa_rag import get_rag_system
+    from src.tools import create_financial_context_lookup_tool
+    from src.agents import create_math_agent, create_financial_research_agent
+    from src.workflow import create_application_workflow
+    
     print("Initializing Financial Chat System...")
     
     # 1. Initialize LLM
@@ -28,7 +58,8 @@ def finqa_app():
     llm = ChatOpenAI(**llm_configs)
 
     # 2. Initialize RAG System
-    rag_system_instance = FinancialRAGSystem(dataset_path=DATASET_PATH)
+    with _rag_build_lock():
+        rag_system_instance = get_rag_system(DATASET_PATH)
 
     # 3. Create Tools
     financial_lookup_tool = create_financial_context_lookup_tool(rag_system_instance)
@@ -40,9 +71,30 @@ def finqa_app():
     # 5. Create Workflow
     app = create_application_workflow(llm, math_agent_instance, financial_agent_instance)
     
+    # 6. Warm up the model and HTTP connections so the first test doesn't pay the cold start
+    try:
+        for _ in app.stream({"messages": [{"role": "user", "content": "ping"}]},
+                            {"configurable": {"thread_id": "warmup"}}, stream_mode="messages"):
+            pass
+    except Exception as e:
+        print(f"Warning: Warmup request failed: {e}")
+    
     return app
 
 
+@pytest.fixture(scope="session")
+def session_loop():
+    """One event loop for every async test in the session.
+    
+    The app's async HTTP clients bind their connection pools to the loop that first used them,
+    so a fresh loop per test (asyncio.run) would leave later tests with "Event loop is closed".
+    """
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    loop.close()
+
+
 @pytest.fixture
 def sample_question():
     """Sample question for testing"""
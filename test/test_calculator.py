@@ -0,0 +1,61 @@
+"""
+Calculator tool tests (no LLM required)
+"""
+
+import asyncio
+
+import pytest
+from src.tools import batch_calculator, calculator
+
+
+def calculate(expression: str) -> str:
+    return calculator.invoke({"expression": expression})
+
+
+class TestCalculator:
+    """Test the AST-based calculator tool"""
+    
+    @pytest.mark.parametrize("expression, expected", [
+        ("2 + 3 * 4", "14"),
+        ("(10 + 5) / 3", "5"),
+        ("sqrt(16)", "4"),
+        ("sin(pi/2)", "1"),
+        ("2**3", "8"),
+        ("pow(2, 10)", "1024"),
+        ("10**-20000", "0"),
+        ("pow(2, -40000)", "0"),
+        ("1e5 * 2", "200000"),
+        ("((206588 - 181001) / 181001) * 100", "14.13638599"),
+        ("round(3.14159, 2)", "3.14"),
+        ("max(1, 2)", "2"),
+    ])
+    def test_valid_expressions(self, expression, expected):
+        """Test that supported arithmetic evaluates correctly"""
+        assert calculate(expression) == expected
+    
+    @pytest.mark.parametrize("expression", [
+        "__import__('os')",
+        "open('secrets.txt')",
+        "().__class__",
+        "x + 1",
+        "'a' * 3",
+        "9**9**9",
+        "(9**9999)**9999",
+        "pow(10, 10**7)",
+        "pow(9, 9**9)",
+        "pow(pow(9, 9999), 9999)",
+    ])
+    def test_rejected_expressions(self, expression):
+        """Test that names, attributes and oversized powers are rejected"""
+        assert calculate(expression).startswith("Error")
+    
+    def test_division_by_zero(self):
+        """Test division by zero is reported"""
+        assert calculate("1/0") == "Error: Division by zero."
+
+    def test_batch_calculator_preserves_order(self):
+        """Test the batch tool returns one result per expression, sync and async"""
+        expressions = ["1 + 1", "1/0", "sqrt(16)"]
+        expected = ["2", "Error: Division by zero.", "4"]
+        assert batch_calculator.invoke({"expressions": expressions}) == expected
+        assert asyncio.run(batch_calculator.ainvoke({"expressions": expressions})) == expected
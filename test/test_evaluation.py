@@ -4,16 +4,22 @@ Evaluation tests for FinQAChat system integrated with pytest.
 Samples questions from the dataset for quick accuracy validation.
 """
 
+import functools
 import sys
 import os
 import json
+import threading
 import time
-import uuid
+import itertools
 import pytest
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Optional, Any
-from dataclasses import dataclass, asdict
+from typing import List, Dict, Optional, Any, Tuple
+from dataclasses import dataclass
+import httpx
+import numpy as np
+import orjson
 from pydantic import BaseModel
 
 # Add project root to path for module imports
@@ -21,13 +27,12 @@ project_root = os.path.dirname(os.path.dirname(__file__))
 sys.path.insert(0, project_root)
 
 # Import from src module
-from src.config import get_llm_config, DATASET_PATH
-from src.finqa_rag import FinancialRAGSystem  
-from src.tools import create_financial_context_lookup_tool, calculator
-from src.agents import create_math_agent, create_financial_research_agent
-from src.workflow import create_application_workflow
+from src.config import ThinkFilter, get_llm_config, DATASET_PATH
 from langchain_openai import ChatOpenAI
 
+from .utils.extraction import has_final_answer, is_answer_message
+from .utils.file_helpers import _ensure_dir
+
 @dataclass
 class EvaluationResult:
     """Single evaluation result"""
@@ -40,6 +45,8 @@ class EvaluationResult:
     numerical_match: bool
     error: Optional[str]
     session_id: str
+    extracted_num: Optional[float] = None  # Parsed once when scoring
+    expected_num: Optional[float] = None
 
 class PercentageExtraction(BaseModel):
     """Structured output for percentage extraction"""
@@ -48,21 +55,31 @@ class PercentageExtraction(BaseModel):
     confidence: str = "high"  # high, medium, low
     reasoning: str = ""
 
-def extract_percentage_from_response(response: str) -> Optional[str]:
-    """Extract percentage value from response using LLM structured output"""
-    if not response:
-        return None
-    
-    # Initialize a simple LLM for extraction
-    try:
-        from langchain_openai import ChatOpenAI
-        from src.config import get_llm_config
-        
-        llm_config = get_llm_config()
-        extraction_llm = ChatOpenAI(**llm_config)
-        
-        # Create structured extraction prompt
-        extraction_prompt = f"""
+try:
+    import re2 as _pct_engine # google-re2: linear-time DFA matching, no backtracking
+except ImportError: # Optional dependency, the stdlib engine gives the same matches
+    _pct_engine = re
+
+_PRINT_LOCK = threading.Lock()
+
+# Thread ids only need to be unique within this process's checkpointer; the pid keeps parallel workers apart
+_SESSION_IDS = itertools.count()
+
+# Percentages like "14.1%" or "20 %"; compiled once and tried before any LLM call
+_PCT_RE = _pct_engine.compile(r'(\d+\.?\d*)\s*%')
+
+@functools.lru_cache(maxsize=1)
+def _get_extraction_llm() -> ChatOpenAI:
+    """Shared client for the LLM extraction fallback, built on first use"""
+    # One pooled HTTP client, sized for the batched extraction calls, keeps connections alive between questions
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        timeout=httpx.Timeout(60.0)
+    )
+    return ChatOpenAI(**get_llm_config(), http_client=http_client)
+
+def _extraction_prompt(response: str) -> str:
+    return f"""
         Extract the final percentage answer from this financial analysis response.
         
         Response to analyze:
@@ -83,158 +100,231 @@ def extract_percentage_from_response(response: str) -> Optional[str]:
             "reasoning": "Found final answer '14.1%' in conclusion"
         }}
         """
+
+def _parse_extraction(content: str) -> Optional[str]:
+    """Read the percentage out of the extraction LLM's JSON reply"""
+    try:
+        result_json = json.loads(content.strip())
         
-        # Get structured response
-        extraction_response = extraction_llm.invoke(extraction_prompt)
+        if result_json.get("percentage_value") is not None:
+            return result_json.get("percentage_string") or f"{result_json['percentage_value']}%"
         
-        # Parse JSON response
-        try:
-            result_json = json.loads(extraction_response.content.strip())
-            
-            if result_json.get("percentage_value") is not None:
-                return result_json.get("percentage_string") or f"{result_json['percentage_value']}%"
-            
-        except (json.JSONDecodeError, KeyError) as e:
-            print(f"⚠️  JSON parsing failed: {e}")
-            # Fallback to simple regex
-            pass
-    
-    except Exception as e:
-        print(f"⚠️  LLM extraction failed: {e}")
-        # Fallback to simple regex
-        pass
+    except (json.JSONDecodeError, KeyError) as e:
+        print(f"⚠️  JSON parsing failed: {e}")
+    return None
+
+def extract_percentages_from_responses(responses: List[str]) -> List[Optional[str]]:
+    """Extract the percentage from each response, sending all regex misses to the LLM in one batch"""
+    extracted: List[Optional[str]] = [None] * len(responses)
+    pending = []
+    for i, response in enumerate(responses):
+        if not response:
+            continue
+        # Fast path: take the last percentage in the response, no network round-trip
+        matches = _PCT_RE.findall(response)
+        if matches:
+            extracted[i] = f"{matches[-1]}%"
+        elif '%' in response or 'percent' in response.lower():
+            pending.append(i)
+        # Otherwise the response never mentions a percentage, so there is nothing for the LLM to find
     
-    # Fallback: simple regex extraction
-    pattern = r'(\d+\.?\d*)\s*%'
-    matches = re.findall(pattern, response)
-    if matches:
-        return f"{matches[-1]}%"
+    if pending:
+        # Fallback: ask the LLM for structured output (e.g. "fourteen percent"), all leftovers concurrently
+        try:
+            replies = _get_extraction_llm().batch(
+                [_extraction_prompt(responses[i]) for i in pending], return_exceptions=True)
+            for i, reply in zip(pending, replies):
+                if isinstance(reply, Exception):
+                    print(f"⚠️  LLM extraction failed: {reply}")
+                else:
+                    extracted[i] = _parse_extraction(reply.content)
+        except Exception as e:
+            print(f"⚠️  LLM extraction failed: {e}")
     
-    return None
+    return extracted
 
+def extract_percentage_from_response(response: str) -> Optional[str]:
+    """Extract percentage value from response, using the LLM only when no percentage is found by regex"""
+    return extract_percentages_from_responses([response])[0]
+
+@functools.lru_cache(maxsize=4096)
 def normalize_percentage(percentage_str: str) -> Optional[float]:
     """Convert percentage string to float for comparison"""
-    if not percentage_str:
-        return None
     try:
-        # Remove % sign and convert to float
-        return float(percentage_str.replace('%', '').strip())
-    except (ValueError, AttributeError):
+        # Remove % sign and convert to float (float() ignores surrounding whitespace)
+        return float(percentage_str.replace('%', ''))
+    except (ValueError, AttributeError): # Empty string or None
         return None
 
-def evaluate_single_question(app, question: str, expected_answer: str, timeout: float = 120.0) -> EvaluationResult:
-    """Evaluate a single question and return detailed results"""
-    session_id = str(uuid.uuid4())
+def _run_question(app, question: str, timeout: float, early_exit: bool = True) -> Dict[str, Any]:
+    """Stream one question through the workflow and return its filtered response and timing"""
+    session_id = f"eval-{os.getpid()}-{next(_SESSION_IDS):08x}"
     config = {"configurable": {"thread_id": session_id}}
     
-    start_time = time.time()
-    response_content = ""
+    start_time = time.monotonic()
+    deadline = start_time + timeout
+    response_parts = []
+    think_filter = ThinkFilter() # Strips <think> blocks as chunks arrive
+    tail = "" # Last few hundred visible characters, enough for the early-exit check
     error = None
     
+    stream = app.stream({
+        "messages": [{"role": "user", "content": question}]
+    }, config, stream_mode="messages")
     try:
-        for msg, metadata in app.stream({
-            "messages": [{"role": "user", "content": question}]
-        }, config, stream_mode="messages"):
+        for msg, metadata in stream:
             
             # Check timeout
-            if time.time() - start_time > timeout:
+            if time.monotonic() > deadline:
                 error = f"Timeout after {timeout} seconds"
                 break
+            
+            content = getattr(msg, 'content', None)
+            if content:
+                response_parts.append(content)
+                visible = think_filter.feed(content)
                 
-            if hasattr(msg, 'content') and msg.content:
-                response_content += msg.content
+                # Stop decoding once the math expert states the answer; reasoning and tool text never reach the tail
+                if early_exit and visible and is_answer_message(msg, metadata):
+                    tail = (tail + visible)[-256:]
+                    if has_final_answer(tail):
+                        break
                 
     except Exception as e:
         error = str(e)
+    finally:
+        # Closing the generator cancels the rest of the run instead of leaving it pending
+        if hasattr(stream, 'close'):
+            stream.close()
     
-    end_time = time.time()
-    response_time = end_time - start_time
+    response_time = time.monotonic() - start_time
+    response_content = "".join(response_parts)
     
-    # Filter out thinking tokens and clean response
-    from src.config import filter_response
-    filtered_response = filter_response(response_content)
+    # Thinking tokens were already filtered while streaming
+    filtered_response = think_filter.result()
     
-    # Extract percentage from filtered response
-    print(f"\n🔍 DEBUG: Full response length: {len(response_content)} -> {len(filtered_response)} (filtered)")
-    print(f"📝 Filtered response: {filtered_response[:500]}...")
+    with _PRINT_LOCK: # Questions may run on worker threads; keep each debug block together
+        print(f"\n🔍 DEBUG: Full response length: {len(response_content)} -> {len(filtered_response)} (filtered)")
+        print(f"📝 Filtered response: {filtered_response[:500]}...")
     
-    extracted_answer = extract_percentage_from_response(filtered_response)
+    return {
+        'session_id': session_id,
+        'filtered_response': filtered_response,
+        'response_time': response_time,
+        'error': error,
+    }
+
+def _numerical_matches(extracted_nums: List[Optional[float]], expected_nums: List[Optional[float]]) -> np.ndarray:
+    """Vectorized tolerance check; a value that didn't parse becomes NaN and never matches"""
+    def to_array(nums):
+        return np.fromiter((np.nan if n is None else n for n in nums), dtype=np.float64, count=len(nums))
+    return np.abs(to_array(extracted_nums) - to_array(expected_nums)) < 0.1
+
+def _score_result(question: str, expected_answer: str, run: Dict[str, Any], extracted_answer: Optional[str],
+                  extracted_num: Optional[float], expected_num: Optional[float], numerical_match: bool) -> EvaluationResult:
+    """Compare the extracted answer with the expected one"""
     print(f"🎯 Extracted answer: {extracted_answer}")
     
-    # Calculate matches
+    # Exact string match (case insensitive)
     exact_match = False
-    numerical_match = False
-    
     if extracted_answer and expected_answer:
-        # Exact string match (case insensitive)
         exact_match = extracted_answer.lower() == expected_answer.lower()
-        
-        # Numerical match with tolerance
-        extracted_num = normalize_percentage(extracted_answer)
-        expected_num = normalize_percentage(expected_answer)
-        
-        if extracted_num is not None and expected_num is not None:
-            numerical_match = abs(extracted_num - expected_num) < 0.1
     
     return EvaluationResult(
         question=question,
         expected_answer=expected_answer,
         extracted_answer=extracted_answer,
-        full_response=filtered_response,  # Store filtered response instead of raw
-        response_time=response_time,
+        full_response=run['filtered_response'],  # Store filtered response instead of raw
+        response_time=run['response_time'],
         exact_match=exact_match,
         numerical_match=numerical_match,
-        error=error,
-        session_id=session_id
+        error=run['error'],
+        session_id=run['session_id'],
+        extracted_num=extracted_num,
+        expected_num=expected_num
     )
 
+def evaluate_single_question(app, question: str, expected_answer: str, timeout: float = 120.0,
+                             early_exit: bool = True) -> EvaluationResult:
+    """Evaluate a single question and return detailed results"""
+    run = _run_question(app, question, timeout, early_exit)
+    extracted_answer = extract_percentage_from_response(run['filtered_response'])
+    extracted_num = normalize_percentage(extracted_answer)
+    expected_num = normalize_percentage(expected_answer)
+    numerical_match = bool(_numerical_matches([extracted_num], [expected_num])[0])
+    return _score_result(question, expected_answer, run, extracted_answer, extracted_num, expected_num, numerical_match)
+
+def evaluate_questions(app, questions: List[Dict[str, str]], timeout: float = 120.0,
+                       early_exit: bool = True) -> List[EvaluationResult]:
+    """Evaluate several questions concurrently, then extract all answers in one batch"""
+    # Each run is network-bound on the LLM, so threads overlap the waits (the GIL is released during I/O)
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(questions)))) as executor:
+        runs = list(executor.map(lambda qa: _run_question(app, qa['question'], timeout, early_exit), questions))
+    extracted = extract_percentages_from_responses([run['filtered_response'] for run in runs])
+    extracted_nums = [normalize_percentage(answer) for answer in extracted]
+    expected_nums = [normalize_percentage(qa['answer']) for qa in questions]
+    # Numerical matches for the whole batch in one array operation
+    matches = _numerical_matches(extracted_nums, expected_nums).tolist()
+    return [
+        _score_result(qa['question'], qa['answer'], run, answer, extracted_num, expected_num, match)
+        for qa, run, answer, extracted_num, expected_num, match
+        in zip(questions, runs, extracted, extracted_nums, expected_nums, matches)
+    ]
+
+@functools.lru_cache(maxsize=8)
+def _sample_questions_cached(dataset_path: str, num_samples: int) -> Tuple[Tuple[str, str], ...]:
+    """Parse and sample the dataset once per (path, sample size); errors propagate and are not cached"""
+    with open(dataset_path, 'rb') as f:
+        # Peek at the first non-whitespace byte to tell a JSON array from JSON lines
+        first_char = f.read(1)
+        while first_char.isspace():
+            first_char = f.read(1)
+        f.seek(0)
+        
+        if first_char == b'[':
+            data = orjson.loads(f.read())
+        else:
+            # JSON lines format, parsed line by line instead of splitting one big string
+            data = [orjson.loads(line) for line in f if line.strip()]
+    
+    questions = []
+    for item in data:
+        if 'qa' in item and 'question' in item['qa'] and 'answer' in item['qa']:
+            qa = item['qa']
+            if qa['question'].strip() and qa['answer'].strip():
+                questions.append({
+                    'question': qa['question'],
+                    'answer': qa['answer']
+                })
+    
+    # Sample questions strategically
+    sampled = []
+    
+    # Always include the canonical test question if available
+    canonical_question = "what was the percentage change in the net cash from operating activities from 2008 to 2009"
+    canonical = next((q for q in questions if canonical_question in q['question'].lower()), None)
+    if canonical is not None:
+        sampled.append(canonical)
+    
+    # Add additional samples if needed
+    remaining_needed = num_samples - len(sampled)
+    if remaining_needed > 0:
+        # Skip the canonical question if already added (set lookup rather than dict comparisons)
+        seen = {(q['question'], q['answer']) for q in sampled}
+        available_questions = [q for q in questions if (q['question'], q['answer']) not in seen]
+        # Take every nth question to get good coverage
+        step = max(1, len(available_questions) // remaining_needed)
+        for i in range(0, min(len(available_questions), remaining_needed * step), step):
+            if len(sampled) < num_samples:
+                sampled.append(available_questions[i])
+    
+    return tuple((q['question'], q['answer']) for q in sampled[:num_samples])
+
 def load_sample_questions(dataset_path: str, num_samples: int = 2) -> List[Dict[str, str]]:
     """Load a sample of questions from the dataset for evaluation"""
     try:
-        with open(dataset_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            
-            if content.startswith('['):
-                data = json.loads(content)
-            else:
-                # JSON lines format
-                data = []
-                for line in content.split('\n'):
-                    if line.strip():
-                        data.append(json.loads(line))
-        
-        questions = []
-        for item in data:
-            if 'qa' in item and 'question' in item['qa'] and 'answer' in item['qa']:
-                qa = item['qa']
-                if qa['question'].strip() and qa['answer'].strip():
-                    questions.append({
-                        'question': qa['question'],
-                        'answer': qa['answer']
-                    })
-        
-        # Sample questions strategically
-        sampled = []
-        
-        # Always include the canonical test question if available
-        canonical_question = "what was the percentage change in the net cash from operating activities from 2008 to 2009"
-        for q in questions:
-            if canonical_question.lower() in q['question'].lower():
-                sampled.append(q)
-                break
-        
-        # Add additional samples if needed
-        remaining_needed = num_samples - len(sampled)
-        if remaining_needed > 0:
-            # Skip the canonical question if already added
-            available_questions = [q for q in questions if q not in sampled]
-            # Take every nth question to get good coverage
-            step = max(1, len(available_questions) // remaining_needed)
-            for i in range(0, min(len(available_questions), remaining_needed * step), step):
-                if len(sampled) < num_samples:
-                    sampled.append(available_questions[i])
-        
-        return sampled[:num_samples]
+        # Fresh dicts per call, so callers can't mutate the cached sample
+        return [{'question': q, 'answer': a} for q, a in _sample_questions_cached(dataset_path, num_samples)]
         
     except Exception as e:
         print(f"Warning: Could not load questions from {dataset_path}: {e}")
@@ -248,14 +338,18 @@ def load_sample_questions(dataset_path: str, num_samples: int = 2) -> List[Dict[
 
 def save_evaluation_results(results: List[EvaluationResult], output_file: str):
     """Save evaluation results to JSON file"""
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    _ensure_dir(os.path.dirname(output_file) or '.')
     
     # Calculate summary stats
     total = len(results)
-    successful = sum(1 for r in results if r.error is None)
-    exact_matches = sum(1 for r in results if r.exact_match)
-    numerical_matches = sum(1 for r in results if r.numerical_match)
-    avg_time = sum(r.response_time for r in results) / total if total > 0 else 0
+    successful = exact_matches = numerical_matches = 0
+    total_time = 0.0
+    for r in results: # One pass over the results for every counter
+        successful += r.error is None
+        exact_matches += r.exact_match
+        numerical_matches += r.numerical_match
+        total_time += r.response_time
+    avg_time = total_time / total if total > 0 else 0
     
     output_data = {
         'metadata': {
@@ -273,11 +367,16 @@ def save_evaluation_results(results: List[EvaluationResult], output_file: str):
             'average_response_time': avg_time,
             'error_rate': (total - successful) / total if total > 0 else 0
         },
-        'detailed_results': [asdict(result) for result in results]
+        'detailed_results': results
     }
     
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, indent=2, ensure_ascii=False)
+    # orjson serializes the dataclasses directly and writes UTF-8 bytes
+    with open(output_file, 'wb') as f:
+        f.write(orjson.dumps(
+            output_data,
+            option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_DATACLASS,
+            default=str
+        ))
 
 class TestEvaluation:
     """Evaluation tests for FinQA system"""
@@ -289,11 +388,12 @@ class TestEvaluation:
         
         assert len(questions) > 0, "Should load at least one question from dataset"
         
-        results = []
-        
         print(f"\n🔍 Running evaluation on {len(questions)} sample questions...")
         
-        for i, qa in enumerate(questions, 1):
+        # Run every question first so answer extraction happens in one batch
+        results = evaluate_questions(finqa_app, questions)
+        
+        for i, (qa, result) in enumerate(zip(questions, results), 1):
             print(f"\n{'='*60}")
             print(f"📝 QUESTION {i}/{len(questions)}")
             print(f"{'='*60}")
@@ -301,10 +401,6 @@ class TestEvaluation:
             print(f"Expected Answer: {qa['answer']}")
             print(f"{'='*60}")
             
-            # Run evaluation
-            result = evaluate_single_question(finqa_app, qa['question'], qa['answer'])
-            results.append(result)
-            
             # Print detailed comparison
             print(f"\n📊 RESULTS:")
             print(f"   System Answer: {result.extracted_answer}")
@@ -329,9 +425,14 @@ class TestEvaluation:
         
         # Overall summary
         total = len(results)
-        exact_matches = sum(1 for r in results if r.exact_match)
-        numerical_matches = sum(1 for r in results if r.numerical_match)
-        avg_time = sum(r.response_time for r in results) / total
+        exact_matches = numerical_matches = successful_responses = 0
+        total_time = 0.0
+        for r in results: # One pass over the results for every counter
+            exact_matches += r.exact_match
+            numerical_matches += r.numerical_match
+            successful_responses += r.error is None and r.extracted_answer is not None
+            total_time += r.response_time
+        avg_time = total_time / total
         
         print(f"\n{'='*60}")
         print(f"🎯 OVERALL EVALUATION SUMMARY")
@@ -343,7 +444,6 @@ class TestEvaluation:
         print(f"{'='*60}")
         
         # Save results
-        os.makedirs('./logs', exist_ok=True)
         output_file = './logs/evaluation_sample_results.json'
         save_evaluation_results(results, output_file)
         print(f"\n💾 Detailed results saved to: {output_file}")
@@ -353,7 +453,6 @@ class TestEvaluation:
         assert avg_time < 120, f"Average response time too slow: {avg_time}s"
         
         # For now, just ensure we get responses (we're debugging accuracy)
-        successful_responses = sum(1 for r in results if r.error is None and r.extracted_answer is not None)
         assert successful_responses > 0, "Should have at least one successful response with extracted percentage"
         
         print(f"\n🎯 DEBUG SUMMARY:")
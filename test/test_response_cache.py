@@ -0,0 +1,65 @@
+"""
+Chat response cache tests (no LLM required)
+"""
+
+from langchain_core.messages import AIMessage
+
+from src.main import _cacheable_answer
+from src.response_cache import SemanticResponseCache
+from src.workflow import create_application_workflow
+
+
+class _FailingAgent:
+    """Stands in for an agent whose model call fails, e.g. the server is down"""
+
+    def invoke(self, inputs, config=None):
+        raise TimeoutError("model request timed out")
+
+
+class _AnsweringAgent:
+    """Stands in for an agent that answers directly, without routing to the math expert"""
+
+    def invoke(self, inputs, config=None):
+        return {"messages": [AIMessage(content="The percentage change is 14.1%")]}
+
+
+def _run_turn(financial_agent, question: str) -> dict:
+    app = create_application_workflow(None, _FailingAgent(), financial_agent)
+    config = {"configurable": {"thread_id": "cache-test"}}
+    app.invoke({"messages": [{"role": "user", "content": question}]}, config)
+    return app.get_state(config).values
+
+
+class TestResponseCache:
+    """Test what the chat interface stores in and replays from the response cache"""
+
+    def test_errored_turn_is_not_cached(self, tmp_path):
+        """Test that an agent error message is never stored as an answer"""
+        question = "what was the percentage change in net cash?"
+        values = _run_turn(_FailingAgent(), question)
+        assert values["messages"][-1]["content"].startswith("Financial agent error:")
+
+        cache = SemanticResponseCache(cache_path=str(tmp_path / "cache.json"))
+        cache.add(question, _cacheable_answer(values))
+
+        assert len(cache) == 0, "Errored turn should not be cached"
+        assert cache.lookup(question) is None
+        assert not (tmp_path / "cache.json").exists(), "Nothing should be persisted"
+
+    def test_answered_turn_is_cached(self, tmp_path):
+        """Test that the final assistant message is stored and replayed"""
+        question = "what was the percentage change in net cash?"
+        values = _run_turn(_AnsweringAgent(), question)
+
+        cache = SemanticResponseCache(cache_path=str(tmp_path / "cache.json"))
+        cache.add(question, _cacheable_answer(values))
+
+        assert cache.lookup("What was the percentage  change in net cash?") == "The percentage change is 14.1%"
+
+    def test_fingerprint_change_discards_saved_answers(self, tmp_path):
+        """Test that answers saved for another model or dataset are not replayed"""
+        path = str(tmp_path / "cache.json")
+        SemanticResponseCache(cache_path=path, fingerprint="model-a|train.json").add("q", "14.1%")
+
+        assert SemanticResponseCache(cache_path=path, fingerprint="model-a|train.json").lookup("q") == "14.1%"
+        assert len(SemanticResponseCache(cache_path=path, fingerprint="model-b|train.json")) == 0
@@ -3,183 +3,15 @@
 Pytest test suite for the FinQA chat system
 """
 
-import sys
 import os
 import json
-import time
-import uuid
 import pytest
-import re
 from datetime import datetime
-from pydantic import BaseModel, Field
-from typing import Optional
 
-# Add project root to path for module imports
-project_root = os.path.dirname(os.path.dirname(__file__))
-sys.path.insert(0, project_root)
-
-# Import from src module
-from src.config import get_llm_config, DATASET_PATH
-from src.finqa_rag import FinancialRAGSystem  
-from src.tools import create_financial_context_lookup_tool, calculator
-from src.agents import create_math_agent, create_financial_research_agent
-from src.workflow import create_application_workflow
-from langchain_openai import ChatOpenAI
-
-class StructuredFinancialAnswer(BaseModel):
-    """Structured format for financial answers with percentage extraction"""
-    final_answer: str = Field(description="The final numerical answer (e.g., '14.1%', '25.5%')")
-    calculation_steps: list[str] = Field(description="Step-by-step calculation breakdown")
-    source_values: dict = Field(description="Key financial values used in calculation")
-    confidence_level: str = Field(description="Confidence in the answer: high, medium, low")
-
-def extract_percentage_from_response(response: str) -> Optional[str]:
-    """Extract percentage value from response text"""
-    # Look for percentage patterns like "14.1%" or "14.1 percent"
-    percentage_patterns = [
-        r'(\d+\.?\d*)\s*%',  # Matches "14.1%" or "14%"
-        r'(\d+\.?\d*)\s*percent',  # Matches "14.1 percent"
-        r'is\s+(\d+\.?\d*)\s*%',  # Matches "is 14.1%"
-        r'answer:\s*(\d+\.?\d*)\s*%',  # Matches "answer: 14.1%"
-    ]
-    
-    for pattern in percentage_patterns:
-        match = re.search(pattern, response, re.IGNORECASE)
-        if match:
-            return f"{match.group(1)}%"
-    
-    return None
-
-def run_structured_question(app, question, expected_answer, timeout_seconds=120):
-    """Run a question with structured output and validation"""
-    session_id = str(uuid.uuid4())
-    config = {"configurable": {"thread_id": session_id}}
-    
-    start_time = time.time()
-    response_content = ""
-    error = None
-    
-    try:
-        for msg, metadata in app.stream({
-            "messages": [{"role": "user", "content": question}]
-        }, config, stream_mode="messages"):
-            if time.time() - start_time > timeout_seconds:
-                error = f"Timeout after {timeout_seconds} seconds"
-                break
-                
-            if hasattr(msg, 'content') and msg.content:
-                response_content += msg.content
-        
-    except Exception as e:
-        error = str(e)
-    
-    end_time = time.time()
-    
-    # Extract percentage from response
-    extracted_percentage = extract_percentage_from_response(response_content)
-    
-    # Validate against expected answer
-    answer_matches = False
-    if extracted_percentage and expected_answer:
-        # Normalize both answers for comparison
-        extracted_num = float(extracted_percentage.replace('%', ''))
-        expected_num = float(expected_answer.replace('%', ''))
-        # Allow small tolerance for floating point comparison
-        answer_matches = abs(extracted_num - expected_num) < 0.1
-    
-    return {
-        'session_id': session_id,
-        'question': question,
-        'full_response': response_content,
-        'extracted_percentage': extracted_percentage,
-        'expected_answer': expected_answer,
-        'answer_matches': answer_matches,
-        'response_time_seconds': end_time - start_time,
-        'timestamp': datetime.now().isoformat(),
-        'error': error,
-        'success': error is None
-    }
-
-@pytest.fixture(scope="session")
-def finqa_app():
-    """Initialize the FinQA system components (session-scoped fixture)"""
-    print("Initializing Financial Chat System...")
-    
-    # 1. Initialize LLM
-    llm_configs = get_llm_config()
-    llm = ChatOpenAI(**llm_configs)
-
-    # 2. Initialize RAG System
-    rag_system_instance = FinancialRAGSystem(dataset_path=DATASET_PATH)
-
-    # 3. Create Tools
-    financial_lookup_tool = create_financial_context_lookup_tool(rag_system_instance)
-
-    # 4. Create Agents
-    math_agent_instance = create_math_agent(llm)
-    financial_agent_instance = create_financial_research_agent(llm, financial_lookup_tool)
-
-    # 5. Create Workflow
-    app = create_application_workflow(llm, math_agent_instance, financial_agent_instance)
-    
-    return app
-
-def run_question(app, question, run_number, timeout_seconds=30):
-    """Run a single question and return the response with metadata"""
-    print(f"\n--- Run {run_number} ---")
-    print(f"Question: {question}")
-    
-    # Create unique session for each run
-    session_id = str(uuid.uuid4())
-    config = {"configurable": {"thread_id": session_id}}
-    
-    start_time = time.time()
-    response_content = ""
-    error = None
-    
-    try:
-        print("Response: ", end="", flush=True)
-        message_count = 0
-        for msg, metadata in app.stream({
-            "messages": [{"role": "user", "content": question}]
-        }, config, stream_mode="messages"):
-            # Check timeout
-            if time.time() - start_time > timeout_seconds:
-                error = f"Timeout after {timeout_seconds} seconds"
-                break
-                
-            if hasattr(msg, 'content') and msg.content:
-                response_content += msg.content
-                print(msg.content, end="", flush=True)
-                message_count += 1
-        print("\n")
-        
-    except Exception as e:
-        error = str(e)
-        print(f"\nError: {error}")
-    
-    end_time = time.time()
-    response_time = end_time - start_time
-    
-    return {
-        'run_number': run_number,
-        'session_id': session_id,
-        'question': question,
-        'response': response_content,
-        'response_time_seconds': response_time,
-        'timestamp': datetime.now().isoformat(),
-        'error': error,
-        'success': error is None
-    }
-
-def save_results_to_json(results, filename='test_results.json'):
-    """Save results to JSON file"""
-    # Ensure the directory exists
-    os.makedirs(os.path.dirname(filename), exist_ok=True)
-    with open(filename, 'w', encoding='utf-8') as jsonfile:
-        json.dump(results, jsonfile, indent=4)
-    
-    print(f"\nResults saved to {filename}")
+# Shared implementations, so optimizations to the runners and extraction apply to these tests too
+from .utils.runners import run_basic_question, run_structured_question
+from .utils import file_helpers
+from .utils.file_helpers import find_ground_truth_answer, save_results_to_json
 
 class TestFinQASystem:
     """Test class for FinQA chat system"""
@@ -187,7 +19,7 @@ class TestFinQASystem:
     def test_single_question(self, finqa_app):
         """Test a single question execution"""
         question = "what was the percentage change in the net cash from operating activities from 2008 to 2009"
-        result = run_question(finqa_app, question, 1)
+        result = run_basic_question(finqa_app, question, 1)
         
         assert result['success'], f"Test failed with error: {result['error']}"
         assert result['response'], "Response should not be empty"
@@ -200,12 +32,11 @@ class TestFinQASystem:
         # Run multiple tests and collect results
         results = []
         for i in range(1, 2):
-            result = run_question(finqa_app, question, i, timeout_seconds=120)  # Increased timeout for complete responses
+            result = run_basic_question(finqa_app, question, i, timeout_seconds=120)  # Increased timeout for complete responses
             results.append(result)
             assert result['success'], f"Run {i} failed with error: {result['error']}"
         
         # Save results to JSON file for inspection
-        os.makedirs('./logs', exist_ok=True)
         save_results_to_json(results, './logs/pytest_test_results.json')
         
         # Verify file was created
@@ -241,7 +72,6 @@ class TestFinQASystem:
         assert result['answer_matches'], f"Expected {expected_answer}, got {result['extracted_percentage']}"
         
         # Save detailed results
-        os.makedirs('./logs', exist_ok=True)
         save_results_to_json([result], './logs/structured_test_results.json')
         
         print(f"\n=== Structured Test Results ===")
@@ -256,7 +86,7 @@ class TestFinQASystem:
     def test_multiple_runs(self, finqa_app, run_number):
         """Test multiple runs of the same question"""
         question = "what was the percentage change in the net cash from operating activities from 2008 to 2009"
-        result = run_question(finqa_app, question, run_number)
+        result = run_basic_question(finqa_app, question, run_number)
         
         assert result['success'], f"Run {run_number} failed with error: {result['error']}"
         assert result['response'], f"Response should not be empty for run {run_number}"
@@ -268,7 +98,7 @@ class TestFinQASystem:
     def test_response_timeout(self, finqa_app):
         """Test that responses complete within reasonable time"""
         question = "what was the percentage change in the net cash from operating activities from 2008 to 2009"
-        result = run_question(finqa_app, question, 1, timeout_seconds=60)
+        result = run_basic_question(finqa_app, question, 1, timeout_seconds=60)
         
         assert result['response_time_seconds'] < 60, "Response should complete within timeout"
 
@@ -298,5 +128,39 @@ def test_save_results_functionality(tmp_path):
     assert len(loaded_results) == 1, "Should save one result"
     assert loaded_results[0]['success'] == True, "Should preserve success status"
 
+@pytest.fixture
+def ground_truth_file(tmp_path):
+    """Small dataset in train.json's layout, with a repeated question and an item without 'qa'"""
+    data = [
+        {'id': 'a', 'qa': {'question': 'what was the change?', 'answer': '14.1%'}},
+        {'id': 'b', 'table': [['2008', '2009']]},
+        {'id': 'c', 'qa': {'question': 'what was the ratio?', 'answer': '0.5'}},
+        {'id': 'd', 'qa': {'question': 'what was the change?', 'answer': '99%'}},
+    ]
+    path = tmp_path / "train.json"
+    path.write_text(json.dumps(data))
+    file_helpers._index_ground_truth.cache_clear()
+    yield str(path)
+    file_helpers._index_ground_truth.cache_clear()
+
+def test_find_ground_truth_answer_without_ijson(ground_truth_file, monkeypatch):
+    """Test the lookup when the dataset is loaded whole with orjson"""
+    monkeypatch.setattr(file_helpers, "ijson", None)
+    
+    assert find_ground_truth_answer(ground_truth_file, 'what was the ratio?') == '0.5'
+    assert find_ground_truth_answer(ground_truth_file, 'what was the change?') == '14.1%', "First answer should win"
+
+def test_find_ground_truth_answer_with_ijson(ground_truth_file):
+    """Test the lookup when the dataset is streamed with ijson"""
+    pytest.importorskip("ijson")
+    
+    assert find_ground_truth_answer(ground_truth_file, 'what was the ratio?') == '0.5'
+    assert find_ground_truth_answer(ground_truth_file, 'what was the change?') == '14.1%', "First answer should win"
+
+def test_find_ground_truth_answer_missing_question(ground_truth_file):
+    """Test that an unknown question raises ValueError"""
+    with pytest.raises(ValueError, match="Question not found"):
+        find_ground_truth_answer(ground_truth_file, 'what was the margin?')
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file
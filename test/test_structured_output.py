@@ -3,9 +3,11 @@ Structured output tests with answer validation
 """
 
 import pytest
-from .utils.runners import run_structured_question
+from langchain_core.messages import AIMessageChunk, ToolMessage
+
+from .utils.runners import run_batched_structured_questions, run_structured_question
 from .utils.file_helpers import save_results_to_json, print_structured_summary
-from .utils.extraction import extract_percentage_from_response, validate_percentage_answer
+from .utils.extraction import extract_percentage_from_response, extract_percentages_batch, validate_percentage_answer
 
 
 class TestStructuredOutput:
@@ -24,6 +26,10 @@ class TestStructuredOutput:
         for response, expected in test_cases:
             result = extract_percentage_from_response(response)
             assert result == expected, f"Expected {expected}, got {result} for '{response}'"
+        
+        # The batch helper gives the same answers, in order
+        responses, expected_answers = zip(*test_cases)
+        assert extract_percentages_batch(list(responses)) == list(expected_answers)
     
     def test_percentage_validation(self):
         """Test percentage validation logic"""
@@ -33,6 +39,33 @@ class TestStructuredOutput:
         assert validate_percentage_answer(None, "14.1%") == False
         assert validate_percentage_answer("14.1%", None) == False
     
+    def test_early_exit_on_math_expert_answer(self):
+        """Test that the run stops at the math expert's final answer, not at earlier mentions"""
+        financial = {'langgraph_node': 'agent', 'checkpoint_ns': 'financial_research_expert:1'}
+        math = {'langgraph_node': 'agent', 'checkpoint_ns': 'math_expert:2'}
+        chunks = [
+            (ToolMessage(content="REFERENCE ANSWER: 14.1% (from dataset)", tool_call_id="1"),
+             {'langgraph_node': 'tools', 'checkpoint_ns': 'financial_research_expert:1'}),
+            (AIMessageChunk(content="Final answer: 99%. Data extracted. NEED_MATH_CALCULATION."), financial),
+            (AIMessageChunk(content="<think>final answer: 1%</think>"), math),
+            (AIMessageChunk(content="Final answer: 14.1"), math),
+            (AIMessageChunk(content="%\n"), math),
+            (AIMessageChunk(content="The calculator returned 14.136..."), math),
+        ]
+        consumed = []
+        
+        class _ScriptedApp:
+            def stream(self, inputs, config, stream_mode):
+                for chunk in chunks:
+                    consumed.append(chunk)
+                    yield chunk
+        
+        result = run_structured_question(_ScriptedApp(), "question", "14.1%")
+        
+        assert len(consumed) == 5, "Run should stop right after the math expert states the answer"
+        assert result['full_response'].endswith("Final answer: 14.1%\n")
+        assert result['success'] and result['error'] is None
+    
     def test_structured_output_with_validation(self, finqa_app, sample_question, expected_answer, logs_dir):
         """Test with structured output extraction and ground truth validation"""
         result = run_structured_question(finqa_app, sample_question, expected_answer)
@@ -108,12 +141,10 @@ class TestStructuredOutput:
     
     def test_multiple_structured_runs(self, finqa_app, sample_question, expected_answer, logs_dir):
         """Test consistency across multiple structured runs"""
-        results = []
+        # 3 runs for consistency testing, issued together
+        results = run_batched_structured_questions(finqa_app, sample_question, 3, expected_answer)
         
-        for i in range(3):  # 3 runs for consistency testing
-            result = run_structured_question(finqa_app, sample_question, expected_answer)
-            results.append(result)
-            
+        for i, result in enumerate(results):
             assert result['success'], f"Run {i+1} failed: {result['error']}"
         
         # Analyze consistency
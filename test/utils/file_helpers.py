@@ -2,35 +2,72 @@
 File handling utilities for test results
 """
 
+import functools
 import os
-import json
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List
+
+import orjson
+
+try:
+    import ijson # Optional: streams the dataset instead of loading it whole
+except ImportError:
+    ijson = None
+
+
+@functools.lru_cache(maxsize=None)
+def _ensure_dir(directory: str) -> None:
+    """Create an output directory once per session; later calls are a cache hit"""
+    os.makedirs(directory, exist_ok=True)
 
 
 def save_results_to_json(results: List[Dict[str, Any]], filename: str) -> None:
     """Save results to JSON file"""
     # Ensure the directory exists
-    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    _ensure_dir(os.path.dirname(filename) or '.')
     
-    with open(filename, 'w', encoding='utf-8') as jsonfile:
-        json.dump(results, jsonfile, indent=4, ensure_ascii=False)
+    # orjson serializes in C and emits UTF-8 bytes directly (non-ASCII kept as-is, like ensure_ascii=False);
+    # OPT_NON_STR_KEYS accepts int keys the way json.dump did
+    with open(filename, 'wb') as jsonfile:
+        jsonfile.write(orjson.dumps(results, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
     
     print(f"\nResults saved to {filename}")
 
 
 def load_ground_truth_data(filepath: str) -> Dict[str, Any]:
     """Load ground truth data from train.json"""
-    with open(filepath, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    with open(filepath, 'rb') as f:
+        data = orjson.loads(f.read())
     return data
 
 
-def find_ground_truth_answer(data: List[Dict], question: str) -> str:
+@functools.lru_cache(maxsize=4)
+def _index_ground_truth(filepath: str) -> Dict[str, str]:
+    """Question -> answer map for a dataset file, built once per path"""
+    index = {}
+    for qa in _iter_qa(filepath):
+        # setdefault keeps the first answer for a repeated question, as the old linear scan did
+        index.setdefault(qa['question'], qa['answer'])
+    return index
+
+
+def _iter_qa(filepath: str) -> Iterator[Dict[str, Any]]:
+    """Yield each item's 'qa' block from a JSON-array dataset"""
+    if ijson is None:
+        for item in load_ground_truth_data(filepath):
+            if 'qa' in item:
+                yield item['qa']
+        return
+    # Streamed: only the qa blocks are materialized, not the tables and texts around them
+    with open(filepath, 'rb') as f:
+        yield from ijson.items(f, 'item.qa')
+
+
+def find_ground_truth_answer(filepath: str, question: str) -> str:
     """Find ground truth answer for a specific question"""
-    for item in data:
-        if 'qa' in item and item['qa']['question'] == question:
-            return item['qa']['answer']
-    raise ValueError(f"Question not found in ground truth data: {question}")
+    try:
+        return _index_ground_truth(filepath)[question]
+    except KeyError:
+        raise ValueError(f"Question not found in ground truth data: {question}") from None
 
 
 def print_test_summary(results: List[Dict[str, Any]]) -> None:
@@ -2,12 +2,17 @@
 Test runners for different types of FinQA tests
 """
 
+import os
 import time
-import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, Any, Optional
 
-from .extraction import extract_percentage_from_response, validate_percentage_answer
+from src.config import StreamBuffer, ThinkFilter
+
+from .extraction import (
+    extract_percentage_from_response, has_final_answer, is_answer_message, validate_percentage_answer
+)
 
 
 def run_basic_question(app, question: str, run_number: int, timeout_seconds: int = 30) -> Dict[str, Any]:
@@ -16,11 +21,13 @@ def run_basic_question(app, question: str, run_number: int, timeout_seconds: int
     print(f"Question: {question}")
     
     # Create unique session for each run
-    session_id = str(uuid.uuid4())
+    session_id = os.urandom(8).hex()  # Only needs to be unique, not an RFC 4122 UUID
     config = {"configurable": {"thread_id": session_id}}
     
-    start_time = time.time()
-    response_content = ""
+    start_time = time.monotonic()
+    deadline = start_time + timeout_seconds
+    response_chunks = []  # Joined once after streaming
+    echo = StreamBuffer(min_chars=8192, max_delay=0.025)  # Echo in batches, not one flushed write per chunk
     error = None
     
     try:
@@ -29,20 +36,24 @@ def run_basic_question(app, question: str, run_number: int, timeout_seconds: int
             "messages": [{"role": "user", "content": question}]
         }, config, stream_mode="messages"):
             # Check timeout
-            if time.time() - start_time > timeout_seconds:
+            if time.monotonic() > deadline:
                 error = f"Timeout after {timeout_seconds} seconds"
                 break
                 
-            if hasattr(msg, 'content') and msg.content:
-                response_content += msg.content
-                print(msg.content, end="", flush=True)
+            content = getattr(msg, 'content', None)
+            if content:
+                response_chunks.append(content)
+                echo.write(content)
+        echo.flush()
         print("\n")
         
     except Exception as e:
+        echo.flush()
         error = str(e)
         print(f"\nError: {error}")
     
-    end_time = time.time()
+    end_time = time.monotonic()
+    response_content = "".join(response_chunks)
     response_time = end_time - start_time
     
     return {
@@ -57,30 +68,96 @@ def run_basic_question(app, question: str, run_number: int, timeout_seconds: int
     }
 
 
-def run_structured_question(app, question: str, expected_answer: str, timeout_seconds: int = 120) -> Dict[str, Any]:
-    """Run a question with structured output and validation"""
-    session_id = str(uuid.uuid4())
+async def arun_basic_question(app, question: str, run_number: int, timeout_seconds: int = 30) -> Dict[str, Any]:
+    """Async variant of run_basic_question, so several sessions can stream concurrently"""
+    # Create unique session for each run
+    session_id = os.urandom(8).hex()
     config = {"configurable": {"thread_id": session_id}}
     
-    start_time = time.time()
-    response_content = ""
+    start_time = time.monotonic()
+    deadline = start_time + timeout_seconds
+    response_chunks = []  # Joined once after streaming
     error = None
     
     try:
-        for msg, metadata in app.stream({
+        async for msg, metadata in app.astream({
             "messages": [{"role": "user", "content": question}]
         }, config, stream_mode="messages"):
-            if time.time() - start_time > timeout_seconds:
+            # Check timeout
+            if time.monotonic() > deadline:
                 error = f"Timeout after {timeout_seconds} seconds"
                 break
                 
-            if hasattr(msg, 'content') and msg.content:
-                response_content += msg.content
+            content = getattr(msg, 'content', None)
+            if content:
+                response_chunks.append(content)
         
     except Exception as e:
         error = str(e)
     
-    end_time = time.time()
+    end_time = time.monotonic()
+    response_content = "".join(response_chunks)
+    
+    # Printed once complete, since concurrent runs would interleave streamed tokens
+    print(f"\n--- Run {run_number} ---")
+    print(f"Question: {question}")
+    print(f"Response: {response_content}" if error is None else f"Error: {error}")
+    
+    return {
+        'run_number': run_number,
+        'session_id': session_id,
+        'question': question,
+        'response': response_content,
+        'response_time_seconds': end_time - start_time,
+        'timestamp': datetime.now().isoformat(),
+        'error': error,
+        'success': error is None
+    }
+
+
+def run_structured_question(app, question: str, expected_answer: str, timeout_seconds: int = 120,
+                            early_exit: bool = True) -> Dict[str, Any]:
+    """Run a question with structured output and validation"""
+    session_id = os.urandom(8).hex()
+    config = {"configurable": {"thread_id": session_id}}
+    
+    start_time = time.monotonic()
+    deadline = start_time + timeout_seconds
+    response_chunks = []  # Joined once after streaming
+    think_filter = ThinkFilter()  # Reasoning text never counts as the final answer
+    tail = ""
+    error = None
+    
+    stream = app.stream({
+        "messages": [{"role": "user", "content": question}]
+    }, config, stream_mode="messages")
+    try:
+        for msg, metadata in stream:
+            # Check timeout
+            if time.monotonic() > deadline:
+                error = f"Timeout after {timeout_seconds} seconds"
+                break
+                
+            content = getattr(msg, 'content', None)
+            if content:
+                response_chunks.append(content)
+                if early_exit:
+                    visible = think_filter.feed(content)
+                    # Only the math expert's own reply may end the run; tool output can quote the dataset answer
+                    if visible and is_answer_message(msg, metadata):
+                        tail = (tail + visible)[-256:]
+                        if has_final_answer(tail):
+                            break
+        
+    except Exception as e:
+        error = str(e)
+    finally:
+        # Closing the generator cancels the rest of the run
+        if hasattr(stream, 'close'):
+            stream.close()
+    
+    end_time = time.monotonic()
+    response_content = "".join(response_chunks)
     
     # Extract percentage from response
     extracted_percentage = extract_percentage_from_response(response_content)
@@ -103,29 +180,46 @@ def run_structured_question(app, question: str, expected_answer: str, timeout_se
     }
 
 
+def run_batched_structured_questions(app, question: str, n_replicas: int, expected_answer: str,
+                                     timeout_seconds: int = 120) -> list[Dict[str, Any]]:
+    """Run independent replicas of a structured question concurrently, results in replica order"""
+    # Each replica keeps its own session so the answers stay independent; running them together
+    # costs roughly one round-trip of wall time, and the server can reuse the shared prompt prefix
+    with ThreadPoolExecutor(max_workers=max(1, n_replicas)) as executor:
+        return list(executor.map(
+            lambda _: run_structured_question(app, question, expected_answer, timeout_seconds),
+            range(n_replicas)
+        ))
+
+
+def _failed_result(run_number: int, question: str, exc: Exception) -> Dict[str, Any]:
+    """Result record for a run that raised before producing a response"""
+    return {
+        'run_number': run_number,
+        'session_id': 'error',
+        'question': question,
+        'response': '',
+        'response_time_seconds': 0,
+        'timestamp': datetime.now().isoformat(),
+        'error': str(exc),
+        'success': False
+    }
+
+
 def run_performance_test(app, question: str, num_runs: int = 5, timeout_seconds: int = 60) -> list[Dict[str, Any]]:
     """Run multiple performance tests"""
-    results = []
-    
-    for i in range(1, num_runs + 1):
-        try:
-            result = run_basic_question(app, question, i, timeout_seconds)
-            results.append(result)            
-        except KeyboardInterrupt:
-            print(f"\nTest interrupted after {len(results)} runs")
-            break
-        except Exception as e:
-            print(f"Error in run {i}: {e}")
-            # Add failed result
-            results.append({
-                'run_number': i,
-                'session_id': 'error',
-                'question': question,
-                'response': '',
-                'response_time_seconds': 0,
-                'timestamp': datetime.now().isoformat(),
-                'error': str(e),
-                'success': False
-            })
-    
-    return results
\ No newline at end of file
+    results: list[Optional[Dict[str, Any]]] = [None] * num_runs
+    
+    try:
+        for i in range(num_runs):
+            try:
+                results[i] = run_basic_question(app, question, i + 1, timeout_seconds)
+            except Exception as e:
+                print(f"Error in run {i + 1}: {e}")
+                results[i] = _failed_result(i + 1, question, e)
+    except KeyboardInterrupt:
+        completed = [r for r in results if r is not None]
+        print(f"\nTest interrupted after {len(completed)} runs")
+        return completed
+    
+    return results